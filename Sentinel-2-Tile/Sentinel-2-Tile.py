@@ -21,9 +21,16 @@
 # The base path for a Sentinel-2 tile is the metadata.xml. The file must be in same directory as tileInfo.json file and the R10m, R20m and R60m folders.
 
 import os
+import datetime
 import json
+import numpy
+import sqlite3
+import threading
+import time
 import arcpy
+from collections import namedtuple
 from functools import lru_cache
+from types import MappingProxyType
 
 try:
     import xml.etree.cElementTree as ET
@@ -31,8 +38,27 @@ except ImportError:
     import xml.etree.ElementTree as ET
 
 ns = {'n1': 'https://psd-12.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd', 
-        'n2': 'https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd',
-        'nx': ''} # nx is set either to n1 or n2 depending on the processed metadata file
+        'n2': 'https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd'}
+
+# Values extracted from metadata.xml of one tile. Records are immutable and can be shared between threads.
+# geopositions maps the resolution ('10', '20', '60') to a Geoposition, bandAngles maps the bandId to a BandAngle.
+TileMetadata = namedtuple('TileMetadata', ['epsg', 'sensingTime', 'cloudCoverage', 'vegetationPercentage', 'geopositions', 'bandAngles'])
+Geoposition = namedtuple('Geoposition', ['ulx', 'uly', 'xdim', 'ydim'])
+BandAngle = namedtuple('BandAngle', ['sourceBandIndex', 'zenithAngle', 'azimuthAngle', 'unit'])
+# Values read from tileInfo.json of one tile; footprint is a tuple of (x, y) vertices of tileDataGeometry
+TileInfo = namedtuple('TileInfo', ['productName', 'groupName', 'footprint'])
+
+# Path of the persistent SQLite tile cache (see TileCache); no persistent cache is used if the variable is not set
+TILE_CACHE_VARIABLE = 'SENTINEL2_TILE_CACHE'
+# 'write' (default) writes a .j2w world file next to every band unless an identical one exists,
+# 'none' writes no world files and relies on the georeferencing embedded in the JP2 files
+WORLD_FILES_VARIABLE = 'SENTINEL2_WORLD_FILES'
+# JSON lines file receiving the stage times of every built item (see BuildTelemetry), set by SentinelImporter.py
+TELEMETRY_VARIABLE = 'SENTINEL2_TELEMETRY'
+# Weights of the Rank field as 'cloud=<weight>,recency=<weight>' (default cloud=1,recency=0.05), see Utilities.getRank
+RANK_WEIGHTS_VARIABLE = 'SENTINEL2_RANK_WEIGHTS'
+# Recency of the Rank field is counted in days from the launch of Sentinel-2A
+RANK_EPOCH = datetime.date(2015, 6, 23)
 
 bandProperties = {
                   13: {'bandName': 'B00', 'bandIndex': 0, 'filename': '../qi/CLD_20m.jp2', 'wavelengthMin': 0.0, 'wavelengthMax': 0.0 },
@@ -55,6 +81,27 @@ Rxm = { '10m': { 'bandKeys': [1, 2, 3, 7], 'rasterFunctionTemplate': 'Composite4
         '20c': { 'bandKeys': [13, 1, 2, 3, 4, 5, 6, 8, 11, 12], 'rasterFunctionTemplate': 'Composite10Bands.rft.xml' }  # 20m + cloudMask as band B00
 }
 
+# Static part of the items of one resolution, resolved once from bandProperties and Rxm (see buildTemplates).
+# bandFolder and fileNames give the band files relative to the tile folder in raster function order,
+# bandProperties holds the per band keyProperties without the viewing angles of the item,
+# typeBandProperties the entries of the module level bandProperties reported by getRasterTypesInfo.
+BuildTemplate = namedtuple('BuildTemplate', ['bandFolder', 'fileNames', 'rasterFunction', 'argumentNames', 'bandProperties', 'typeBandProperties'])
+
+def createBuildTemplate(resolution):
+    bandKeys = Rxm[resolution]['bandKeys']
+    return BuildTemplate('R' + resolution.replace('c', 'm'),
+                         tuple(bandProperties[k]['filename'] for k in bandKeys),
+                         Rxm[resolution]['rasterFunctionTemplate'],
+                         tuple('Raster' + str(i + 1) for i in range(len(bandKeys))),
+                         tuple(MappingProxyType({'BandName': bandProperties[b]['bandName'],
+                                                 'WavelengthMin': bandProperties[b]['wavelengthMin'],
+                                                 'WavelengthMax': bandProperties[b]['wavelengthMax'],
+                                                 'SourceBandIndex': bandProperties[b]['bandIndex']})
+                               for b in bandProperties if b in bandKeys),
+                         tuple(bandProperties[b] for b in bandProperties if b in bandKeys))
+
+buildTemplates = MappingProxyType({resolution: createBuildTemplate(resolution) for resolution in Rxm})
+
 
 class DataSourceType():
     Unknown = 0
@@ -94,6 +141,18 @@ class RasterTypeFactory():
         self.vegetationPercentage_auxField.aliasName = 'Vegetation Percentage'
         self.vegetationPercentage_auxField.type = 'Double'
         self.vegetationPercentage_auxField.precision = 5
+
+        self.validPixelPercentage_auxField = arcpy.Field()
+        self.validPixelPercentage_auxField.name = 'ValidPixelPercentage'
+        self.validPixelPercentage_auxField.aliasName = 'Valid Pixel Percentage'
+        self.validPixelPercentage_auxField.type = 'Double'
+        self.validPixelPercentage_auxField.precision = 5
+
+        self.rank_auxField = arcpy.Field()
+        self.rank_auxField.name = 'Rank'
+        self.rank_auxField.aliasName = 'Rank'
+        self.rank_auxField.type = 'Double'
+        self.rank_auxField.precision = 9
         rasterTypes = [
                 {
                     'rasterTypeName': 'Sentinel-2-L2A-10mTile',
@@ -105,7 +164,7 @@ class RasterTypeFactory():
                     'supportsOrthorectification': False,
                     'enableClipToFootprint': True,
                     'isRasterProduct': True,
-                    # #'crawlerName': 'Sentinel2Tile10mCrawler',
+                    'crawlerName': 'Sentinel2Tile10mCrawler',
                     'productDefinitionName': 'Sentinel-2_L2A_Tile',
                     'supportedUriFilters': [
                                             {
@@ -126,15 +185,17 @@ class RasterTypeFactory():
                                                 'outputDatasetTag': '10m-4Band',
                                                 'primaryInputDatasetTag': '10m',
                                                 'isProductTemplate': True,
-                                                'functionTemplate': Rxm['10m']['rasterFunctionTemplate']
+                                                'functionTemplate': buildTemplates['10m'].rasterFunction
                                             }                                        
                                            ],
-                    'bandProperties': [bandProperties[k] for k in bandProperties if k in Rxm['10m']['bandKeys']],
+                    'bandProperties': list(buildTemplates['10m'].typeBandProperties),
                     'fields': [self.sensorName_auxField,
                                self.productName_auxField,
                                self.acquisitionDate_auxField,
                                self.cloudCoverage_auxField,
-                               self.vegetationPercentage_auxField]
+                               self.vegetationPercentage_auxField,
+                               self.validPixelPercentage_auxField,
+                               self.rank_auxField]
                 },
                 {
                     'rasterTypeName': 'Sentinel-2-L2A-20mTile',
@@ -146,7 +207,7 @@ class RasterTypeFactory():
                     'supportsOrthorectification': False,
                     'enableClipToFootprint': True,
                     'isRasterProduct': True,
-                    # #'crawlerName': 'Sentinel2Tile10mCrawler',
+                    'crawlerName': 'Sentinel2Tile20mCrawler',
                     'productDefinitionName': 'Sentinel-2_L2A_Tile',
                     'supportedUriFilters': [
                                             {
@@ -167,15 +228,17 @@ class RasterTypeFactory():
                                                 'outputDatasetTag': '20m-9Band',
                                                 'primaryInputDatasetTag': '20m',
                                                 'isProductTemplate': True,
-                                                'functionTemplate': Rxm['20m']['rasterFunctionTemplate']
+                                                'functionTemplate': buildTemplates['20m'].rasterFunction
                                             }
                                            ],
-                    'bandProperties': [bandProperties[k] for k in bandProperties if k in Rxm['20m']['bandKeys']],
+                    'bandProperties': list(buildTemplates['20m'].typeBandProperties),
                     'fields': [self.sensorName_auxField,
                                self.productName_auxField,
                                self.acquisitionDate_auxField,
                                self.cloudCoverage_auxField,
-                               self.vegetationPercentage_auxField]
+                               self.vegetationPercentage_auxField,
+                               self.validPixelPercentage_auxField,
+                               self.rank_auxField]
                 },
                 {
                     'rasterTypeName': 'Sentinel-2-L2A-20mCloudTile',
@@ -187,7 +250,7 @@ class RasterTypeFactory():
                     'supportsOrthorectification': False,
                     'enableClipToFootprint': True,
                     'isRasterProduct': True,
-                    # #'crawlerName': 'Sentinel2Tile10mCrawler',
+                    'crawlerName': 'Sentinel2Tile20mCrawler',
                     'productDefinitionName': 'Sentinel-2_L2A_Tile',
                     'supportedUriFilters': [
                                             {
@@ -208,15 +271,17 @@ class RasterTypeFactory():
                                                 'outputDatasetTag': '20m-10Band',
                                                 'primaryInputDatasetTag': '20m',
                                                 'isProductTemplate': True,
-                                                'functionTemplate': Rxm['20c']['rasterFunctionTemplate']
+                                                'functionTemplate': buildTemplates['20c'].rasterFunction
                                             }
                                            ],
-                    'bandProperties': [bandProperties[k] for k in bandProperties if k in Rxm['20c']['bandKeys']],
+                    'bandProperties': list(buildTemplates['20c'].typeBandProperties),
                     'fields': [self.sensorName_auxField,
                                self.productName_auxField,
                                self.acquisitionDate_auxField,
                                self.cloudCoverage_auxField,
-                               self.vegetationPercentage_auxField]
+                               self.vegetationPercentage_auxField,
+                               self.validPixelPercentage_auxField,
+                               self.rank_auxField]
                 }
                ]
         return rasterTypes
@@ -233,37 +298,60 @@ class Utilities():
         # check for element name
         # check for tileInfo.json
         # check for directory and jp2 files
-        isS2Tile = False
-        tree = cacheElementTree(path)
-        if tree is not None:
-            element = tree.getroot()
-            if element is not None:
-                isS2Tile = element.tag ==  r'{https://psd-12.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd}Level-2A_Tile_ID'            
-
-        return isS2Tile
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        # results (also negative ones) are cached until the file changes
+        return cacheIsS2Tile(path, stat.st_size, stat.st_mtime_ns)
+
+    def readRootTag(self, path, chunkSize=4096, maxSize=65536):
+        """ Returns the tag of the root element, reading only the head of the file. """
+        parser = ET.XMLPullParser(events=('start',))
+        try:
+            with open(path, 'rb') as f:
+                for i in range(maxSize // chunkSize):
+                    chunk = f.read(chunkSize)
+                    if not chunk:
+                        break
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        return element.tag
+        except (OSError, ET.ParseError):
+            pass
+        return None
 
     def getProductType(self, path):
         return 'Sentinel-2_L2A_Tile'
 
-    def getProductName(self, path):
+    def getTileInfoPath(self, path):
         folder, filename = os.path.split(path)
         if filename != 'metadata.xml':
             folder, parent = os.path.split(folder)
-        with open(os.path.join(folder, 'tileInfo.json'), 'r') as f:
-            tileInfo = json.load(f)
-        if 'productName' in tileInfo:
-            return tileInfo['productName']
-        return None
+        return os.path.join(folder, 'tileInfo.json')
 
-    def getGroupName(self, path):
-        folder, filename = os.path.split(path)
-        if filename != 'metadata.xml':
-            folder, parent = os.path.split(folder)
-        with open(os.path.join(folder, 'tileInfo.json'), 'r') as f:
+    def getTileInfo(self, path):
+        """ Returns the TileInfo of the tile, tileInfo.json is read once per tile until it changes. """
+        tileInfoPath = self.getTileInfoPath(path)
+        stat = os.stat(tileInfoPath)
+        return cacheTileInfo(tileInfoPath, stat.st_size, stat.st_mtime_ns)
+
+    def parseTileInfo(self, tileInfoPath):
+        with open(tileInfoPath, 'r') as f:
             tileInfo = json.load(f)
+        groupName = None
         if 'utmZone' in tileInfo and 'latitudeBand' in tileInfo and 'gridSquare' in tileInfo:
-            return "T{0}{1}{2}".format(tileInfo['utmZone'], tileInfo['latitudeBand'], tileInfo['gridSquare'])
-        return None
+            groupName = "T{0}{1}{2}".format(tileInfo['utmZone'], tileInfo['latitudeBand'], tileInfo['gridSquare'])
+        footprint = ()
+        if ('tileDataGeometry' in tileInfo) and ('coordinates' in tileInfo['tileDataGeometry']):
+            footprint = tuple((vertex[0], vertex[1]) for vertex in tileInfo['tileDataGeometry']['coordinates'][0])
+        return TileInfo(tileInfo.get('productName'), groupName, footprint)
+
+    def getProductName(self, path):
+        return self.getTileInfo(path).productName
+
+    def getGroupName(self, path):
+        return self.getTileInfo(path).groupName
 
     def getDisplayName(self, path):
         prodName = self.getProductName(path)
@@ -273,21 +361,250 @@ class Utilities():
                 return dn[-2] + "_" + dn[-1]
         return None
 
-    def getBandAngles(self, tree):
-        angles = tree.find('./nx:Geometric_Info/Tile_Angles/Mean_Viewing_Incidence_Angle_List', ns)
+    def getTileMetadata(self, path):
+        stat = os.stat(path)
+        return cacheTileMetadata(path, stat.st_size, stat.st_mtime_ns)
+
+    def getCloudMaskPath(self, path):
+        return os.path.join(os.path.dirname(self.getTileInfoPath(path)), 'qi', 'MSK_CLOUDS_B00.gml')
+
+    def getRingArea(self, coords):
+        x = coords[:, 0] - coords[0, 0]
+        y = coords[:, 1] - coords[0, 1]
+        return abs(numpy.dot(x[:-1], y[1:]) - numpy.dot(x[1:], y[:-1])) / 2
+
+    def parseCloudMaskArea(self, maskPath):
+        """ Streams MSK_CLOUDS_B00.gml and returns the area of all mask polygons (exteriors less interiors)
+        in map units. Polygons are dropped as soon as they are parsed. """
+        area = 0.0
+        stack = []
+        with open(maskPath, 'rb') as f:
+            for event, element in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(element.tag.rsplit('}', 1)[-1])
+                    continue
+                name = stack.pop()
+                if name == 'posList' and element.text:
+                    coords = numpy.array(element.text.split(), dtype=float).reshape(-1, int(element.get('srsDimension', 2)))
+                    ringArea = self.getRingArea(coords)
+                    area += -ringArea if 'interior' in stack else ringArea
+                    element.clear()
+                elif name == 'MaskFeature':
+                    element.clear()
+        return area
+
+    def getValidPixelPercentage(self, path, footprint):
+        """ Percentage of the footprint not covered by the cloud mask or None if there is no mask. Newer L2A
+        processing baselines ship no MSK_CLOUDS_B00.gml, such tiles get None without a message. """
+        footprintArea = self.getRingArea(numpy.array(footprint, dtype=float)) if len(footprint) > 2 else 0.0
+        if footprintArea <= 0:
+            return None
+        maskPath = self.getCloudMaskPath(path)
+        if not os.path.exists(maskPath):
+            return None
+        try:
+            stat = os.stat(maskPath)
+            maskArea = cacheCloudMaskArea(maskPath, stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError, ET.ParseError) as e:
+            print("Unable to read the cloud mask of {0}\n{1}".format(path, e))
+            return None
+        return float(max(0.0, 100.0 * (1.0 - maskArea / footprintArea)))
+
+    def getRank(self, sensingTime, cloudCoverage):
+        """ Composite rank of an item, lower is better: cloud weight * cloud coverage - recency weight * days since
+        RANK_EPOCH, so one day more recent is worth recency / cloud percent of cloud coverage. The weights are read
+        from SENTINEL2_RANK_WEIGHTS. Returns None if sensing time or cloud coverage is missing. """
+        if not sensingTime or cloudCoverage is None:
+            return None
+        weights = getRankWeights(os.environ.get(RANK_WEIGHTS_VARIABLE, ''))
+        days = (datetime.datetime.strptime(sensingTime[:10], '%Y-%m-%d').date() - RANK_EPOCH).days
+        return weights['cloud'] * cloudCoverage - weights['recency'] * days
+
+    def getWorldFileContent(self, geopos, resolution):
+        """ Content of the .j2w file for all bands of one tile and resolution; pixel centre of the upper left pixel. """
+        return (resolution[:-1] + "\n0\n-0\n-" + resolution[:-1] + "\n" +
+                str(geopos.ulx + geopos.xdim/2) + "\n" + str(geopos.uly + geopos.ydim/2) + "\n")
+
+    def writeWorldFile(self, path, content):
+        try:
+            cacheWorldFile(path, content)
+        except OSError as e:
+            # e.g. read only archive, the georeferencing embedded in the JP2 file is used
+            print("Unable to write {0}\n{1}".format(path, e))
+
+    def parseTileMetadata(self, path):
+        """ Streams metadata.xml once and returns a TileMetadata record. Only the required elements are read,
+        all other elements (e.g. the angle grids) are dropped as soon as they are parsed. Element names are
+        matched without namespace, so PSD-12 and PSD-14 files are handled the same way. """
+        srsEPSG = 0
+        sensingTime = None
+        cloudCoverage = None
+        vegetationPercentage = None
+        geopositions = {}
         bandAngles = {}
-        if angles is not None:
-            for band_info in angles:
-                bandAngle = {}
-                bandAngle['SourceBandIndex'] = int(band_info.attrib['bandId'])
-                zenith_angle = band_info.find('ZENITH_ANGLE')
-                bandAngle['ZenithAngle'] = float(zenith_angle.text)
-                azimut_angle = band_info.find('AZIMUTH_ANGLE')
-                bandAngle['AzimuthAngle'] = float(azimut_angle.text)
-                bandAngle['Unit'] = azimut_angle.attrib['unit']
-                band_num = 0
-                bandAngles[bandAngle['SourceBandIndex']] = bandAngle
-        return bandAngles
+
+        stack = []
+        with open(path, 'rb') as f:
+            for event, element in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(element)
+                    continue
+                stack.pop()
+                name = element.tag.rsplit('}', 1)[-1]
+                parent = stack[-1].tag.rsplit('}', 1)[-1] if stack else None
+                if parent in ('Geoposition', 'Mean_Viewing_Incidence_Angle'):
+                    continue # read together with the parent element
+                if name == 'HORIZONTAL_CS_CODE':
+                    srsEPSG = int((element.text).split(":")[1]) #to get EPSG code
+                elif name == 'SENSING_TIME':
+                    sensingTime = element.text
+                elif name == 'CLOUD_COVERAGE_PERCENTAGE' and parent == 'L2A_Image_Content_QI':
+                    cloudCoverage = float(element.text)
+                elif name == 'VEGETATION_PERCENTAGE' and parent == 'L2A_Image_Content_QI':
+                    vegetationPercentage = float(element.text)
+                elif name == 'Geoposition':
+                    geopositions[element.attrib['resolution']] = Geoposition(int(element.find('ULX').text), int(element.find('ULY').text),
+                                                                             int(element.find('XDIM').text), int(element.find('YDIM').text))
+                elif name == 'Mean_Viewing_Incidence_Angle':
+                    zenith_angle = element.find('ZENITH_ANGLE')
+                    azimut_angle = element.find('AZIMUTH_ANGLE')
+                    bandAngle = BandAngle(int(element.attrib['bandId']), float(zenith_angle.text),
+                                          float(azimut_angle.text), azimut_angle.attrib['unit'])
+                    bandAngles[bandAngle.sourceBandIndex] = bandAngle
+                if stack:
+                    stack[-1].remove(element)
+
+        return TileMetadata(srsEPSG, sensingTime, cloudCoverage, vegetationPercentage,
+                            MappingProxyType(geopositions), MappingProxyType(bandAngles))
+
+class TileFilter():
+    """ Crawl time filter on sensing date (dateFrom, dateTo as YYYY-MM-DD, inclusive), MGRS tile names
+    (e.g. T34UDV) and maximum cloud coverage. Values are taken from the crawler properties, or from the
+    SENTINEL2_DATE_FROM, SENTINEL2_DATE_TO, SENTINEL2_TILES and SENTINEL2_MAX_CLOUD_COVERAGE environment variables. """
+
+    def __init__(self, dateFrom=None, dateTo=None, tiles=None, maxCloudCoverage=None):
+        self.dateFrom = dateFrom
+        self.dateTo = dateTo
+        self.tiles = set(tiles) if tiles else None
+        self.maxCloudCoverage = maxCloudCoverage
+
+    @classmethod
+    def fromProperties(cls, properties):
+        def getValue(name, variable):
+            value = properties.get(name)
+            return value if value not in (None, '') else os.environ.get(variable) or None
+
+        tiles = getValue('tiles', 'SENTINEL2_TILES')
+        if isinstance(tiles, str):
+            tiles = [tile.strip() for tile in tiles.split(',') if tile.strip()]
+        maxCloudCoverage = getValue('maxCloudCoverage', 'SENTINEL2_MAX_CLOUD_COVERAGE')
+        return cls(getValue('dateFrom', 'SENTINEL2_DATE_FROM'), getValue('dateTo', 'SENTINEL2_DATE_TO'), tiles,
+                   float(maxCloudCoverage) if maxCloudCoverage is not None else None)
+
+    def accepts(self, path, utilities):
+        try:
+            if self.tiles is not None and utilities.getGroupName(path) not in self.tiles:
+                return False
+            if self.dateFrom is None and self.dateTo is None and self.maxCloudCoverage is None:
+                return True
+            # the record is cached, the builder doesn't parse the file again
+            metadata = utilities.getTileMetadata(path)
+        except (OSError, ValueError, ET.ParseError) as e:
+            print("Skipping {0}\n{1}".format(path, e))
+            return False
+        sensingDate = (metadata.sensingTime or '')[:10]
+        if self.dateFrom is not None and sensingDate < self.dateFrom:
+            return False
+        if self.dateTo is not None and sensingDate > self.dateTo:
+            return False
+        if self.maxCloudCoverage is not None and (metadata.cloudCoverage is None or metadata.cloudCoverage > self.maxCloudCoverage):
+            return False
+        return True
+
+
+class BuildTelemetry():
+    """ Stage times of one built item, appended as JSON line to the file in SENTINEL2_TELEMETRY when the item
+    is finished. Does nothing if the variable is not set. The tile is identified by the folder of its metadata.xml. """
+    lock = threading.Lock()
+
+    def __init__(self, path, resolution):
+        self.telemetryFile = os.environ.get(TELEMETRY_VARIABLE)
+        self.path = path
+        self.resolution = resolution
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def stageDone(self, stage, start):
+        if self.telemetryFile:
+            self.stages[stage] = time.perf_counter() - start
+
+    def finish(self, exception=None):
+        if not self.telemetryFile:
+            return
+        self.stages['build'] = time.perf_counter() - self.started
+        record = {'source': 'builder', 'tile': os.path.normpath(os.path.abspath(os.path.dirname(self.path or ''))),
+                  'resolution': self.resolution, 'stages': self.stages}
+        if exception is not None:
+            record['error'] = {'type': type(exception).__name__, 'message': str(exception)}
+        try:
+            with self.lock:
+                with open(self.telemetryFile, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+        except OSError:
+            pass
+
+
+class TileCache():
+    """ Persistent SQLite cache of records extracted from tile files, e.g. the TileMetadata of a metadata.xml.
+    A record is valid as long as size and modification time of the source file are unchanged. The same file
+    can be shared by the raster type and SentinelImporter. """
+    current = None
+
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.local = threading.local()
+
+    def getConnection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.cacheFile, timeout=60)
+            connection.execute('CREATE TABLE IF NOT EXISTS records (path TEXT, kind TEXT, size INTEGER, mtime INTEGER, record TEXT, PRIMARY KEY (path, kind))')
+            self.local.connection = connection
+        return connection
+
+    def get(self, path, kind, stat):
+        row = self.getConnection().execute('SELECT size, mtime, record FROM records WHERE path = ? AND kind = ?', (path, kind)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return json.loads(row[2])
+        return None
+
+    def put(self, path, kind, stat, record):
+        connection = self.getConnection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)',
+                               (path, kind, stat.st_size, stat.st_mtime_ns, json.dumps(record)))
+
+    def load(self, path, kind, parse):
+        """ Returns the cached record of kind for path, parse(path) is called and stored if it is missing or outdated.
+        Records must be JSON serializable. """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        record = self.get(path, kind, stat)
+        if record is None:
+            record = parse(path)
+            self.put(path, kind, stat, record)
+        return record
+
+    @classmethod
+    def getCurrent(cls):
+        """ Returns the TileCache configured by SENTINEL2_TILE_CACHE or None. """
+        cacheFile = os.environ.get(TILE_CACHE_VARIABLE)
+        if not cacheFile:
+            return None
+        if cls.current is None or cls.current.cacheFile != cacheFile:
+            cls.current = TileCache(cacheFile)
+        return cls.current
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 # Sentinel 2 Tile builder class
@@ -311,6 +628,7 @@ class Sentinel2TileBuilder(object):
 
         if len(itemURI) <= 0:
             return None
+        telemetry = BuildTelemetry(itemURI.get('path'), resolution)
         try:
             # ItemURI dictionary passed from crawler containing
             # path, tag, display name, group name, product type
@@ -320,36 +638,22 @@ class Sentinel2TileBuilder(object):
             else:
                 return None
 
-            # The metadata file is a XML file
-                #set the correct namespace
-            ns["nx"] = ""
-            with open(path, "r") as f:
-                # check first 2 lines for namespace
-                for i in range(2):
-                    line = f.readline()
-                    ns["nx"] = ns["n1"] if ns["n1"] in line else ns["nx"]
-                    ns["nx"] = ns["n2"] if ns["n2"] in line else ns["nx"]
-
-            tree = cacheElementTree(path)
+            start = time.perf_counter()
+            metadata = self.utilities.getTileMetadata(path)
+            telemetry.stageDone('metadata', start)
             # Horizontal CS (can also be a arcpy.SpatialReference object,
             # EPSG code, path to a PRJ file or a WKT string)
-            srsEPSG = 0
-            #Here, using the epsg code to build srs            
-            projectionNode = tree.find('./nx:Geometric_Info/Tile_Geocoding/HORIZONTAL_CS_CODE', ns)
-
-            if projectionNode is not None:
-                srsEPSG = int((projectionNode.text).split(":")[1]) #to get EPSG code
+            #Here, using the epsg code to build srs
+            srsEPSG = metadata.epsg
 
             # Dataset frame - footprint; this is a list of Vertex coordinates from tileInfo.json
             vertex_array = arcpy.Array()
             folder, filename = os.path.split(path)
-            with open(os.path.join(folder, 'tileInfo.json'), 'r') as f:
-                tileInfo = json.load(f)
-            if ('tileDataGeometry' in tileInfo) and ('coordinates' in tileInfo['tileDataGeometry']):
-                for vertex in tileInfo['tileDataGeometry']['coordinates'][0]:
-                    x_vertex = vertex[0]
-                    y_vertex = vertex[1]                    
-                    vertex_array.add(arcpy.Point(x_vertex, y_vertex))
+            start = time.perf_counter()
+            tileInfo = self.utilities.getTileInfo(path)
+            telemetry.stageDone('tileInfo', start)
+            for x_vertex, y_vertex in tileInfo.footprint:
+                vertex_array.add(arcpy.Point(x_vertex, y_vertex))
             #the order of vertices must be ul, ur, lr, ll
 
             # Get geometry object for the footprint; the SRS of the
@@ -359,78 +663,87 @@ class Sentinel2TileBuilder(object):
             footprint_geometry = arcpy.Polygon(vertex_array, arcpy.SpatialReference(srsEPSG) if srsEPSG > 0 else None)
 
             # Other keyProperties information (Cloud Coverage, Vegeneation Percentage etc)
+            displayName = self.utilities.getDisplayName(path)
             keyProperties = {}
             keyProperties['Footprint'] = footprint_geometry
-            keyProperties['BlockName'] = self.utilities.getGroupName(path)
+            keyProperties['BlockName'] = tileInfo.groupName
             keyProperties['SensorName'] = self.SensorName
             keyProperties['ProductType'] = self.utilities.getProductType(path)
             #Set the Product Name
             if keyProperties['ProductType'] == 'Sentinel-2_L2A_Tile':
-                keyProperties['ProductName'] = self.utilities.getProductName(path)
-                itemURI['GroupName'] = self.utilities.getGroupName(path)
-                itemURI['DisplayName'] = self.utilities.getDisplayName(path)
+                keyProperties['ProductName'] = tileInfo.productName
+                itemURI['GroupName'] = tileInfo.groupName
+                itemURI['DisplayName'] = displayName
 
             # Get the acquisition date of the scene
-            sensing_time = tree.find('./nx:General_Info/SENSING_TIME', ns)            
-            if sensing_time is not None:
-                keyProperties['AcquisitionDate'] = sensing_time.text
-
-            quality_indi = tree.find('./nx:Quality_Indicators_Info', ns) 
-            if quality_indi is not None:
-                # Get the Cloud Coverage
-                cloudCoverage = quality_indi.find('./L2A_Image_Content_QI/CLOUD_COVERAGE_PERCENTAGE')
-                if cloudCoverage is not None:
-                    keyProperties['CloudCoverage'] = float(cloudCoverage.text)
-                    keyProperties['CloudCover'] = float(cloudCoverage.text)
-
-                # Get the Sun Azimuth
-                vegetationPercentage = quality_indi.find('./L2A_Image_Content_QI/VEGETATION_PERCENTAGE')
-                if vegetationPercentage is not None:
-                    keyProperties['VegetationPercentage'] = float(vegetationPercentage.text)
+            if metadata.sensingTime is not None:
+                keyProperties['AcquisitionDate'] = metadata.sensingTime
+
+            # Get the Cloud Coverage
+            if metadata.cloudCoverage is not None:
+                keyProperties['CloudCoverage'] = metadata.cloudCoverage
+                keyProperties['CloudCover'] = metadata.cloudCoverage
+
+            # Get the Vegetation Percentage
+            if metadata.vegetationPercentage is not None:
+                keyProperties['VegetationPercentage'] = metadata.vegetationPercentage
+
+            # Valid pixels and rank, so mosaic rules can use them right after the items are added
+            start = time.perf_counter()
+            validPixelPercentage = self.utilities.getValidPixelPercentage(path, tileInfo.footprint)
+            telemetry.stageDone('cloudMask', start)
+            if validPixelPercentage is not None:
+                keyProperties['ValidPixelPercentage'] = validPixelPercentage
+            rank = self.utilities.getRank(metadata.sensingTime, metadata.cloudCoverage if metadata.cloudCoverage is not None else
+                                          (100.0 - validPixelPercentage if validPixelPercentage is not None else None))
+            if rank is not None:
+                keyProperties['Rank'] = rank
 
             buildItemsList = list()
             buildItem = {} 
-            imparam = [os.path.join(folder, 'R'+resolution.replace("c", "m"), bandProperties[k]['filename']) for k in Rxm[resolution]['bandKeys']]
-
-            geopos = tree.find("./nx:Geometric_Info/Tile_Geocoding/Geoposition[@resolution='" + resolution[:-1] + "']", ns)            
-            for im in imparam:
-                with open(im[:-3]+'j2w', "w") as wf:
-                    wf.write(resolution[:-1] + "\n0\n-0\n-" + resolution[:-1] + "\n")
-                    wf.write(str(int(geopos.find("ULX").text) + int(geopos.find("XDIM").text)/2) + "\n")
-                    wf.write(str(int(geopos.find("ULY").text) + int(geopos.find("YDIM").text)/2) + "\n")
-
-            rfa = {}
-            for i in range(len(imparam)):
-                rfa['Raster'+str(i+1)] = imparam[i]
+            template = buildTemplates[resolution]
+            bandFolder = os.path.join(folder, template.bandFolder)
+            imparam = [os.path.join(bandFolder, f) for f in template.fileNames]
+
+            if os.environ.get(WORLD_FILES_VARIABLE, 'write').lower() != 'none':
+                start = time.perf_counter()
+                worldFile = self.utilities.getWorldFileContent(metadata.geopositions[resolution[:-1]], resolution)
+                for im in imparam:
+                    self.utilities.writeWorldFile(im[:-3]+'j2w', worldFile)
+                telemetry.stageDone('worldFiles', start)
+
             buildItem['raster'] = {
                 'functionDataset': {
-                    'rasterFunction': Rxm[resolution]['rasterFunctionTemplate'],
-                    'rasterFunctionArguments': rfa
+                    'rasterFunction': template.rasterFunction,
+                    'rasterFunctionArguments': dict(zip(template.argumentNames, imparam))
                 }
             }
 
-            ba = self.utilities.getBandAngles(tree)
-            keyProperties['bandProperties'] = [{
-                'BandName': bandProperties[b]['bandName'], 
-                'WavelengthMin': bandProperties[b]['wavelengthMin'],
-                'WavelengthMax': bandProperties[b]['wavelengthMax'],
-                'SourceBandIndex': bandProperties[b]['bandIndex'], 
-                'ZenithAngle': ba[bandProperties[b]['bandIndex']]['ZenithAngle'], 
-                'AzimuthAngle': ba[bandProperties[b]['bandIndex']]['AzimuthAngle'],
-                'Unit': ba[bandProperties[b]['bandIndex']]['Unit']
-                } for b in bandProperties if b in Rxm[resolution]['bandKeys']]
-
-            buildItem['itemURI'] = {'displayName': self.utilities.getDisplayName(path) if not (buildItemsList) else None, 
-                                    'groupName': self.utilities.getGroupName(path)}
+            # the angle keys are left out for bands without a mean viewing incidence angle in metadata.xml
+            ba = metadata.bandAngles
+            keyProperties['bandProperties'] = []
+            for bp in template.bandProperties:
+                bandProps = dict(bp)
+                angle = ba.get(bp['SourceBandIndex'])
+                if angle is not None:
+                    bandProps['ZenithAngle'] = angle.zenithAngle
+                    bandProps['AzimuthAngle'] = angle.azimuthAngle
+                    bandProps['Unit'] = angle.unit
+                keyProperties['bandProperties'].append(bandProps)
+
+            buildItem['itemURI'] = {'displayName': displayName if not (buildItemsList) else None, 
+                                    'groupName': tileInfo.groupName}
             buildItem['spatialReference'] = srsEPSG
             buildItem['footprint'] = footprint_geometry
             buildItem['keyProperties'] = keyProperties
             buildItemsList.append(buildItem)
+            telemetry.finish()
 
             return buildItemsList
 
-        except:
+        except Exception as e:
             print ("Exception from Builder")
+            telemetry.finish(e)
             raise
 
 
@@ -451,84 +764,151 @@ class Sentinel220mCloudTileBuilder(Sentinel2TileBuilder):
 
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
-# Sentinel Crawlerclass
+# Sentinel Crawler class
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 
 
-# class Sentinel2TileCrawler():
-
-#     def __init__(self, **crawlerProperties):
-#         self.utils = Utilities()
-#         self.paths = crawlerProperties['paths']
-#         self.recurse = crawlerProperties['recurse']
-#         self.filter = '*.jp2'
-#         self.currentPath = None
-#         self.pathGenerator = self.createGenerator()
-
-
-#     def __iter__(self):
-#         return self
-
-#     #this is a generator function
-#     def createGenerator(self):
-#         for p in self.paths:
-#             folder, filename = os.path.split(p)
-#             self.currentPath = folder
-#             path = folder + '\\R20m'
-#             if not os.path.exists(path):
-#                 continue
-
-#             if os.path.isdir(path):
-#                 for root, dirs, files in (os.walk(path)):
-#                     for file in (files):
-#                         if file.endswith(".jp2") and file.startswith("B"):
-#                             filename = os.path.join(root, file)
-#                             yield filename
-#             elif path.endswith(".jp2") and file.startswith("B"):
-#                 yield path
-
-#     def next(self):
-#         ## Return URI dictionary to Builder
-#         try:
-#             uri = self.getNextUri()
-#             print(uri['path'])
-#             return uri
-#         except StopIteration:
-#             print("Returninmg empty dict")
-#             return None
-       
-
-#     def getNextUri(self):
-#         self.curPath = next(self.pathGenerator)
-#         curTag = self.utils.getTag(self.curPath)
-#         productName = self.utils.getProductName(self.curPath)
-        
-#         #If the tag or productName was not found in the metadata file or there was some exception raised, we move on to the next item
-#         if curTag is None or productName is None:
-#             return self.getNextUri()
-
-#         uri = {
-#                 'path': self.curPath,
-#                 'displayName': os.path.basename(self.curPath),
-#                 'tag': curTag,
-#                 'groupName': os.path.split(os.path.dirname(self.curPath))[1],
-#                 'productName': productName,
-#                 'metadata': self.currentPath
-#             }
-#         return uri
-
-
-
-@lru_cache(maxsize=128)
-def cacheElementTree(path):
+class Sentinel2TileCrawler():
+    """ Yields the metadata.xml files found in the paths (os.scandir, lazily) as itemURIs with product name,
+    group name and tag filled from tileInfo.json. Tiles rejected by the TileFilter are skipped before
+    any builder work is done. The tag must match primaryInputDatasetTag of the processing template. """
+    tag = None
+
+    def __init__(self, **crawlerProperties):
+        self.utils = Utilities()
+        self.paths = crawlerProperties['paths']
+        if isinstance(self.paths, str):
+            self.paths = self.paths.split(';')
+        self.recurse = crawlerProperties.get('recurse', True)
+        self.tileFilter = TileFilter.fromProperties(crawlerProperties)
+        self.pathGenerator = self.createGenerator()
+
+    def __iter__(self):
+        return self
+
+    def scanFolder(self, folder):
+        folders = [folder]
+        while folders:
+            current = folders.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        # like os.walk, symbolic links and junctions to folders are not followed
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recurse:
+                                folders.append(entry.path)
+                        elif entry.name.lower() == 'metadata.xml':
+                            yield entry.path
+            except OSError as e:
+                print("Unable to read folder {0}\n{1}".format(current, e))
+
+    #this is a generator function
+    def createGenerator(self):
+        for p in self.paths:
+            if os.path.isdir(p):
+                candidates = self.scanFolder(p)
+            elif os.path.basename(p).lower() == 'metadata.xml':
+                candidates = [p]
+            else:
+                continue
+            for path in candidates:
+                if self.tileFilter.accepts(path, self.utils):
+                    yield path
+
+    def next(self):
+        ## Return URI dictionary to Builder
         try:
-            tree = ET.parse(path)
-        except ET.ParseError as e:
-            print("Exception while parsing {0}\n{1}".format(path,e))
+            return self.getNextUri()
+        except StopIteration:
             return None
 
-        return tree
+    def getNextUri(self):
+        while True:
+            path = next(self.pathGenerator)
+            try:
+                # productName is matched against allowedProducts of the URI filter, the product name of the
+                # tile (tileInfo.json) is set by the builder in the keyProperties
+                uri = {
+                        'path': path,
+                        'displayName': self.utils.getDisplayName(path),
+                        'tag': self.tag,
+                        'groupName': self.utils.getGroupName(path),
+                        'productName': self.utils.getProductType(path)
+                    }
+            except (OSError, ValueError) as e:
+                #If tileInfo.json is missing or broken, we move on to the next item
+                print("Skipping {0}\n{1}".format(path, e))
+                continue
+            return uri
+
+class Sentinel2Tile10mCrawler(Sentinel2TileCrawler):
+    tag = '10m'
+
+class Sentinel2Tile20mCrawler(Sentinel2TileCrawler):
+    tag = '20m'
+
+
+@lru_cache(maxsize=65536)
+def cacheWorldFile(path, content):
+    """ Writes the world file unless an identical file exists; repeated calls in the session do no I/O at all. """
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass
+    with open(path, 'w') as wf:
+        wf.write(content)
+
+s2TileRootTags = frozenset('{' + ns[k] + '}Level-2A_Tile_ID' for k in ('n1', 'n2'))
+
+@lru_cache(maxsize=65536)
+def cacheIsS2Tile(path, size, mtime):
+    return Utilities().readRootTag(path) in s2TileRootTags
+
+def tileMetadataToRecord(metadata):
+    record = metadata._asdict()
+    record['geopositions'] = dict(metadata.geopositions)
+    record['bandAngles'] = list(metadata.bandAngles.values())
+    return record
+
+def tileMetadataFromRecord(record):
+    return TileMetadata(record['epsg'], record['sensingTime'], record['cloudCoverage'], record['vegetationPercentage'],
+                        MappingProxyType({k: Geoposition(*v) for k, v in record['geopositions'].items()}),
+                        MappingProxyType({v[0]: BandAngle(*v) for v in record['bandAngles']}))
+
+# the caches below are keyed by path, size and modification time, so a reprocessed tile is read again
+@lru_cache(maxsize=1024)
+def cacheTileInfo(tileInfoPath, size, mtime):
+    tileCache = TileCache.getCurrent()
+    if tileCache is None:
+        return Utilities().parseTileInfo(tileInfoPath)
+    record = tileCache.load(tileInfoPath, 'tileInfo', lambda p: Utilities().parseTileInfo(p)._asdict())
+    return TileInfo(record['productName'], record['groupName'], tuple(tuple(vertex) for vertex in record['footprint']))
+
+@lru_cache(maxsize=1024)
+def cacheCloudMaskArea(maskPath, size, mtime):
+    tileCache = TileCache.getCurrent()
+    if tileCache is None:
+        return Utilities().parseCloudMaskArea(maskPath)
+    return tileCache.load(maskPath, 'maskArea', lambda p: {'area': Utilities().parseCloudMaskArea(p)})['area']
+
+@lru_cache(maxsize=16)
+def getRankWeights(value):
+    """ Parses 'cloud=<weight>,recency=<weight>', missing weights keep their default. """
+    weights = {'cloud': 1.0, 'recency': 0.05}
+    for part in value.split(','):
+        name, sep, weight = part.partition('=')
+        if sep and name.strip() in weights:
+            weights[name.strip()] = float(weight)
+    return MappingProxyType(weights)
+
+@lru_cache(maxsize=1024)
+def cacheTileMetadata(path, size, mtime):
+    tileCache = TileCache.getCurrent()
+    if tileCache is None:
+        return Utilities().parseTileMetadata(path)
+    return tileMetadataFromRecord(tileCache.load(path, 'metadata', lambda p: tileMetadataToRecord(Utilities().parseTileMetadata(p))))
 
-#Using the default crawler as there is only Panchromatic band
 
 
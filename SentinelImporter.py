@@ -1,33 +1,267 @@
 import arcpy
+import copy
 import datetime
+import hashlib
+import hmac
+import json
+import numpy
 import os
+import queue
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import lru_cache
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     import xml.etree.ElementTree as ET
 
+# Path of the persistent SQLite tile cache, the same variable is read by the Sentinel-2-Tile raster type
+TILE_CACHE_VARIABLE = "SENTINEL2_TILE_CACHE"
+# Path of the JSON lines telemetry file (see ImportTelemetry), the raster type appends the stage times of its builders
+TELEMETRY_VARIABLE = "SENTINEL2_TELEMETRY"
+
+# Files read by the raster types per resolution, relative to the tile folder (see Rxm of the raster type)
+BAND_FILES = {"10m": ["R10m/B02.jp2", "R10m/B03.jp2", "R10m/B04.jp2", "R10m/B08.jp2"],
+              "20m": ["R20m/B02.jp2", "R20m/B03.jp2", "R20m/B04.jp2", "R20m/B05.jp2", "R20m/B06.jp2", "R20m/B07.jp2",
+                      "R20m/B8A.jp2", "R20m/B11.jp2", "R20m/B12.jp2"]}
+BAND_FILES["20c"] = ["qi/CLD_20m.jp2"] + BAND_FILES["20m"]
+# Files of a tile needed to select it (filter, deduplication) and by the raster type before the bands are read
+TILE_METADATA_FILES = ["metadata.xml", "tileInfo.json"]
+
+# Values read from tileInfo.json of one tile (same record as in the raster type)
+TileInfo = namedtuple("TileInfo", ["productName", "groupName", "footprint"])
+# Values of one tile used to select tiles before they are imported (see TileFilter), kind "catalog" of the TileCache
+CatalogRecord = namedtuple("CatalogRecord", ["productName", "groupName", "sensingTime", "cloudCoverage", "vegetationPercentage"])
+# A tile read by the preparation threads of importTilesPipelined; mask is the result of CloudMask.readCoordinates,
+# accepted is False for tiles rejected by the TileFilter, error the exception raised while preparing the tile
+PreparedTile = namedtuple("PreparedTile", ["tile", "accepted", "mask", "error"])
+
+class TileCache(object):
+    """ Persistent SQLite cache of records extracted from tile files. A record is valid as long as size and
+    modification time of the source file are unchanged. Same schema as TileCache of the raster type. """
+    current = None
+
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.local = threading.local()
+
+    def getConnection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.cacheFile, timeout=60)
+            connection.execute("CREATE TABLE IF NOT EXISTS records (path TEXT, kind TEXT, size INTEGER, mtime INTEGER, record TEXT, PRIMARY KEY (path, kind))")
+            self.local.connection = connection
+        return connection
+
+    def get(self, path, kind, stat):
+        row = self.getConnection().execute("SELECT size, mtime, record FROM records WHERE path = ? AND kind = ?", (path, kind)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return json.loads(row[2])
+        return None
+
+    def put(self, path, kind, stat, record):
+        connection = self.getConnection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                               (path, kind, stat.st_size, stat.st_mtime_ns, json.dumps(record)))
+
+    def load(self, path, kind, parse):
+        """ Returns the cached record of kind for path, parse(path) is called and stored if it is missing or outdated. """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        record = self.get(path, kind, stat)
+        if record is None:
+            record = parse(path)
+            self.put(path, kind, stat, record)
+        return record
+
+    @classmethod
+    def getCurrent(cls):
+        """ Returns the TileCache configured by SENTINEL2_TILE_CACHE or None. """
+        cacheFile = os.environ.get(TILE_CACHE_VARIABLE)
+        if not cacheFile:
+            return None
+        if cls.current is None or cls.current.cacheFile != cacheFile:
+            cls.current = TileCache(cacheFile)
+        return cls.current
+
+    @classmethod
+    def setCurrent(cls, cacheFile):
+        """ Enables the persistent cache for this process and for the raster type running in it. """
+        os.environ[TILE_CACHE_VARIABLE] = cacheFile
+
+class MaskGeneralization(object):
+    """ Optional generalization of cloud mask polygons before they are inserted. Vertices are removed with
+    Douglas-Peucker up to tolerance (map units of the mask), polygons with more than maxVertices vertices keep
+    only their most significant vertices and polygons smaller than minArea are dropped as slivers. """
+
+    def __init__(self, tolerance=0, maxVertices=None, minArea=0):
+        self.tolerance = tolerance
+        self.maxVertices = max(maxVertices, 4) if maxVertices else None
+        self.minArea = minArea
+        self.verticesIn = 0
+        self.verticesOut = 0
+        self.slivers = 0
+
+    @classmethod
+    def getArea(cls, coords):
+        x = coords[:, 0] - coords[0, 0]
+        y = coords[:, 1] - coords[0, 1]
+        return abs(numpy.dot(x[:-1], y[1:]) - numpy.dot(x[1:], y[:-1])) / 2
+
+    @classmethod
+    def getSignificance(cls, coords):
+        """ Douglas-Peucker significance of every vertex of a closed ring; a vertex with significance s is kept
+        for all tolerances below s. The first vertex and the vertex farthest from it are always kept. """
+        significance = numpy.zeros(len(coords))
+        split = int(numpy.argmax(numpy.hypot(*(coords - coords[0]).T)))
+        significance[[0, split, -1]] = numpy.inf
+        stack = [(0, split, numpy.inf), (split, len(coords) - 1, numpy.inf)]
+        while stack:
+            start, end, parent = stack.pop()
+            if end - start < 2:
+                continue
+            a = coords[start]
+            d = coords[end] - a
+            inner = coords[start + 1:end] - a
+            length = numpy.hypot(*d)
+            if length == 0:
+                distance = numpy.hypot(*inner.T)
+            else:
+                distance = numpy.abs(d[0] * inner[:, 1] - d[1] * inner[:, 0]) / length
+            i = int(numpy.argmax(distance))
+            index = start + 1 + i
+            significance[index] = min(distance[i], parent)
+            stack.append((start, index, significance[index]))
+            stack.append((index, end, significance[index]))
+        return significance
+
+    def apply(self, coords):
+        """ Returns the generalized closed ring or None if the polygon is a sliver. """
+        self.verticesIn += len(coords)
+        if self.minArea and self.getArea(coords) < self.minArea:
+            self.slivers += 1
+            return None
+        if self.tolerance or (self.maxVertices and len(coords) > self.maxVertices):
+            significance = self.getSignificance(coords)
+            keep = significance > self.tolerance
+            if self.maxVertices and keep.sum() > self.maxVertices:
+                keep[:] = False
+                keep[numpy.argsort(significance)[-self.maxVertices:]] = True
+            if keep.sum() < 4:
+                keep[numpy.argsort(significance)[-4:]] = True
+            coords = coords[keep]
+        self.verticesOut += len(coords)
+        return coords
+
+    def startTile(self):
+        self.verticesIn = 0
+        self.verticesOut = 0
+        self.slivers = 0
+
+    def report(self, tile):
+        print("Mask of tile {0}: {1} of {2} vertices removed, {3} slivers dropped.".format(
+              tile, self.verticesIn - self.verticesOut, self.verticesIn, self.slivers))
+
 class CloudMask(object):
     ns = {"eop": "http://www.opengis.net/eop/2.0", "gml": "http://www.opengis.net/gml/3.2"}
 
     @classmethod
-    def parseFeatures(cls, maskGmlFile):
-        tree = cacheElementTree(maskGmlFile)
-        wkid = tree.find('./gml:boundedBy/gml:Envelope', cls.ns).attrib["srsName"].split(":")[-1]
-        rids = tree.getroot().attrib["{"+cls.ns["gml"]+"}id"].split("_")
-        ts = datetime.datetime.strptime(rids[6], '%Y%m%dT%H%M%S')
-        tile = rids[8]
-        features = []
-        maskFeatures = tree.findall('.//eop:MaskFeature', cls.ns)
-        for feature in maskFeatures:
-            fid = (feature.attrib["{"+cls.ns["gml"]+"}id"])
-            ftype = feature.find("eop:maskType", cls.ns).text
-            parray = feature.find("eop:extentOf/gml:Polygon/gml:exterior/gml:LinearRing/gml:posList", cls.ns).text
-            coords = [int(coor) for coor in parray.split(" ")]
-            points = [[coords[2*i], coords[2*i+1]] for i in range(len(coords)//2)]
-            shape = arcpy.Polygon(arcpy.Array([arcpy.Point(*pc) for pc in points]), arcpy.SpatialReference(int(wkid)))
-            features.append((fid, ftype, tile, ts, shape))
-        return features
+    def readMask(cls, maskGmlFile):
+        """ Streams the mask GML file, every MaskFeature is dropped as soon as its polygon is read.
+        Returns a JSON serializable record {wkid, timestamp, tile, features: [[id, type, posList]]}, posList is the
+        text of gml:posList. """
+        gmlId = "{" + cls.ns["gml"] + "}id"
+        envelopeTag = "{" + cls.ns["gml"] + "}Envelope"
+        maskFeatureTag = "{" + cls.ns["eop"] + "}MaskFeature"
+        mask = {"wkid": None, "timestamp": None, "tile": None, "features": []}
+        stack = []
+        with open(maskGmlFile, "rb") as f:
+            for event, element in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if not stack:
+                        rids = element.attrib[gmlId].split("_")
+                        mask["timestamp"] = rids[6]
+                        mask["tile"] = rids[8]
+                    elif element.tag == envelopeTag:
+                        mask["wkid"] = int(element.attrib["srsName"].split(":")[-1])
+                    stack.append(element)
+                    continue
+                stack.pop()
+                if element.tag != maskFeatureTag:
+                    continue
+                fid = (element.attrib[gmlId])
+                ftype = element.find("eop:maskType", cls.ns).text
+                parray = element.find("eop:extentOf/gml:Polygon/gml:exterior/gml:LinearRing/gml:posList", cls.ns).text
+                mask["features"].append([fid, ftype, parray])
+                stack[-1].remove(element)
+        return mask
+
+    @classmethod
+    def loadMask(cls, maskGmlFile):
+        """ readMask through the persistent TileCache, if one is configured. """
+        tileCache = TileCache.getCurrent()
+        if tileCache is None:
+            return cls.readMask(maskGmlFile)
+        return tileCache.load(maskGmlFile, "mask", cls.readMask)
+
+    @classmethod
+    def parseCoordinates(cls, posList):
+        """ Returns the vertices of a gml:posList as (N, 2) array, the ring is closed if necessary. """
+        coords = numpy.fromstring(posList, dtype=numpy.float64, sep=" ").reshape(-1, 2)
+        if len(coords) and not numpy.array_equal(coords[0], coords[-1]):
+            coords = numpy.vstack((coords, coords[:1]))
+        return coords
+
+    @classmethod
+    def createPolygon(cls, coords, spatialReference):
+        """ Creates the polygon from an (N, 2) array of a closed ring via WKB, without an arcpy.Point per vertex. """
+        wkb = struct.pack("<BIII", 1, 3, 1, len(coords)) + numpy.ascontiguousarray(coords, dtype="<f8").tobytes()
+        return arcpy.FromWKB(bytearray(wkb), spatialReference)
+
+    @classmethod
+    def readCoordinates(cls, maskGmlFile, generalization=None):
+        """ Reads the mask without creating geometries, so it can run on any thread. Returns
+        (tile, timestamp, wkid, [(id, type, coords)]), generalization is an optional MaskGeneralization. """
+        mask = cls.loadMask(maskGmlFile)
+        ts = datetime.datetime.strptime(mask["timestamp"], '%Y%m%dT%H%M%S')
+        tile = mask["tile"]
+        polygons = []
+        if generalization:
+            generalization.startTile()
+        for fid, ftype, posList in mask["features"]:
+            coords = cls.parseCoordinates(posList)
+            if generalization:
+                coords = generalization.apply(coords)
+                if coords is None:
+                    continue
+            polygons.append((fid, ftype, coords))
+        if generalization:
+            generalization.report(tile)
+        return (tile, ts, mask["wkid"], polygons)
+
+    @classmethod
+    def createFeatures(cls, maskCoordinates):
+        """ Creates the features of a mask read by readCoordinates. """
+        tile, ts, wkid, polygons = maskCoordinates
+        sr = arcpy.SpatialReference(wkid)
+        return [(fid, ftype, tile, ts, cls.createPolygon(coords, sr)) for fid, ftype, coords in polygons]
+
+    @classmethod
+    def parseFeatures(cls, maskGmlFile, generalization=None):
+        """ generalization is an optional MaskGeneralization applied to the polygons. """
+        return cls.createFeatures(cls.readCoordinates(maskGmlFile, generalization))
 
     @classmethod
     def createFeatureClass(cls, workspace, fcname, spatialReference):
@@ -37,25 +271,651 @@ class CloudMask(object):
         arcpy.management.AddField(fcl, "Type", "TEXT", field_length=20)
         arcpy.management.AddField(fcl, "Tile", "TEXT", field_length=20)
         arcpy.management.AddField(fcl, "Timestamp", "Date")
+        arcpy.management.AddIndex(fcl, "Tile", "TileIdx")
   
         return fcl
 
     @classmethod
     def insertFeatures(cls, features, outputFC):
         """ A polygon featureclass with attributes Id[Text(20)], Type[Text(20)], Tile[Text(20)], Timestamp[Date], Shape[Polygon] is expected in outputFC """
-        outSR = arcpy.Describe(outputFC).spatialReference
+        with CloudMaskWriter(outputFC) as writer:
+            writer.insertFeatures(features)
+
+    @classmethod
+    def deleteFeatures(cls, tile, timestamp, outputFC):
+        """ Deletes the features of one tile mask (same Tile and Timestamp) from outputFC. """
+        with arcpy.da.UpdateCursor(outputFC, ["Timestamp"], "{0} = '{1}'".format(arcpy.AddFieldDelimiters(outputFC, "Tile"), tile)) as ucur:
+            for row in ucur:
+                if row[0] == timestamp:
+                    ucur.deleteRow()
+
+    @classmethod
+    def appendFeatures(cls, maskGmlFile, outputFeatureClass, replace=False):
+        """ With replace the features already loaded from the same mask are deleted first, so repeated
+        appends don't duplicate the mask polygons. outputFeatureClass can also be an open CloudMaskWriter. """
+        if isinstance(outputFeatureClass, CloudMaskWriter):
+            outputFeatureClass.appendFeatures(maskGmlFile, replace)
+            return
+        with CloudMaskWriter(outputFeatureClass) as writer:
+            writer.appendFeatures(maskGmlFile, replace)
+
+class CloudMaskWriter(object):
+    """ Writes cloud mask features of many tiles to one featureclass. The featureclass is described once and
+    a single InsertCursor is kept open until close(); the transformation to the output spatial reference
+    is looked up once per source spatial reference. Polygons are generalized by the optional MaskGeneralization. """
+    fields = ["Id", "Type", "Tile", "Timestamp", "Shape@"]
+
+    def __init__(self, outputFC, generalization=None):
+        self.outputFC = outputFC
+        self.generalization = generalization
+        self.spatialReference = arcpy.Describe(outputFC).spatialReference
+        self.transformations = {}
+        self.cursor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        if self.cursor is not None:
+            del self.cursor
+            self.cursor = None
+
+    def flush(self):
+        """ Commits the rows inserted so far by releasing the cursor, the next insert opens a new one. """
+        self.close()
+
+    def project(self, geom):
+        if geom.spatialReference.factoryCode == self.spatialReference.factoryCode:
+            return geom
+        code = geom.spatialReference.factoryCode
+        if code not in self.transformations:
+            transformations = arcpy.ListTransformations(geom.spatialReference, self.spatialReference)
+            self.transformations[code] = transformations[0] if transformations else None
+        if self.transformations[code]:
+            return geom.projectAs(self.spatialReference, self.transformations[code])
+        return geom.projectAs(self.spatialReference)
+
+    def insertFeatures(self, features):
+        if self.cursor is None:
+            self.cursor = arcpy.da.InsertCursor(self.outputFC, self.fields)
+        for feature in features:
+            self.cursor.insertRow((feature[0], feature[1], feature[2], feature[3], self.project(feature[4])))
+
+    def appendFeatures(self, maskGmlFile, replace=False):
+        tile = os.path.dirname(os.path.dirname(maskGmlFile))
+        start = time.perf_counter()
+        features = CloudMask.parseFeatures(maskGmlFile, self.generalization)
+        ImportTelemetry.stageDone([tile], "maskParse", start)
+        start = time.perf_counter()
+        if replace and features:
+            # the insert cursor holds a write lock
+            self.close()
+            CloudMask.deleteFeatures(features[0][2], features[0][3], self.outputFC)
+        self.insertFeatures(features)
+        ImportTelemetry.stageDone([tile], "maskInsert", start)
+
+class ImportManifest(object):
+    """ JSON file with size and modification time of every imported metadata.xml. """
+
+    def __init__(self, manifestFile):
+        self.manifestFile = manifestFile
+        self.tiles = {}
+        if os.path.exists(manifestFile):
+            with open(manifestFile, "r") as f:
+                self.tiles = json.load(f)
+
+    def getState(self, tile):
+        """ Returns "new", "changed" or "unchanged". """
+        path = os.path.abspath(tile)
+        if path not in self.tiles:
+            return "new"
+        stat = os.stat(path)
+        return "unchanged" if self.tiles[path] == [stat.st_size, stat.st_mtime_ns] else "changed"
+
+    def add(self, tiles):
+        for tile in tiles:
+            path = os.path.abspath(tile)
+            stat = os.stat(path)
+            self.tiles[path] = [stat.st_size, stat.st_mtime_ns]
+
+    def save(self):
+        with open(self.manifestFile + ".tmp", "w") as f:
+            json.dump(self.tiles, f)
+        os.replace(self.manifestFile + ".tmp", self.manifestFile)
+
+class TileFilter(object):
+    """ Import filter on sensing date (dateFrom, dateTo as YYYY-MM-DD, inclusive), MGRS tile names (e.g. T34UDV),
+    maximum cloud coverage, minimum vegetation percentage and an area of interest. Tiles are selected from their
+    catalog records (see SentinelImporter.getCatalogRecord) before anything is added to the mosaic dataset.
+    aoi is an arcpy geometry with spatial reference or a (xmin, ymin, xmax, ymax) box in WGS 84 longitude/latitude;
+    a tile is accepted if its footprint from tileInfo.json intersects it. """
+
+    def __init__(self, dateFrom=None, dateTo=None, tiles=None, maxCloudCoverage=None, minVegetationPercentage=None, aoi=None):
+        self.dateFrom = dateFrom
+        self.dateTo = dateTo
+        self.tiles = set(tiles) if tiles else None
+        self.maxCloudCoverage = maxCloudCoverage
+        self.minVegetationPercentage = minVegetationPercentage
+        self.aoi = aoi
+        # EPSG code -> aoi projected to it, and its extent as plain (xmin, ymin, xmax, ymax)
+        self.projectedAOI = {}
+        self.aoiExtents = {}
+
+    def getAOI(self, epsg):
+        """ Returns the area of interest projected to the coordinate system of the footprints with code epsg.
+        Makes arcpy calls, so it runs on the geoprocessing thread only. """
+        geometry = self.projectedAOI.get(epsg)
+        if geometry is None:
+            aoi = self.aoi
+            if isinstance(aoi, (tuple, list)):
+                # densified, so the edges of the box stay close to the meridians and parallels once projected
+                xmin, ymin, xmax, ymax = aoi
+                steps = numpy.linspace(0.0, 1.0, 17)[:-1]
+                ring = ([(xmin + (xmax - xmin) * t, ymin) for t in steps] + [(xmax, ymin + (ymax - ymin) * t) for t in steps] +
+                        [(xmax - (xmax - xmin) * t, ymax) for t in steps] + [(xmin, ymax - (ymax - ymin) * t) for t in steps])
+                aoi = arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in ring]), arcpy.SpatialReference(4326))
+            geometry = aoi.projectAs(arcpy.SpatialReference(epsg))
+            extent = geometry.extent
+            self.aoiExtents[epsg] = (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+            self.projectedAOI[epsg] = geometry
+        return geometry
+
+    def mayIntersect(self, tile):
+        """ Bounding box test of the tile footprint against the extent of the area of interest, without arcpy calls,
+        so it can run on any thread. Tiles in a coordinate system not projected to by getAOI yet pass. """
+        tileInfo = SentinelImporter.getTileInfo(tile)
+        epsg = SentinelImporter.getEPSG(tile)
+        if tileInfo is None or epsg is None or not tileInfo.footprint:
+            return False
+        extent = self.aoiExtents.get(epsg)
+        if extent is None:
+            return True
+        footprint = numpy.array(tileInfo.footprint, dtype=float)
+        return not (footprint[:, 0].max() < extent[0] or footprint[:, 0].min() > extent[2] or
+                    footprint[:, 1].max() < extent[1] or footprint[:, 1].min() > extent[3])
 
-        with arcpy.da.InsertCursor(outputFC, ["Id", "Type","Tile", "Timestamp", "Shape@"]) as icur:
-            for feature in features:
-                geom = feature[4]
-                if outSR.factoryCode != geom.spatialReference.factoryCode:
-                    geom.projectAs(outSR)
-                icur.insertRow((feature[0], feature[1], feature[2], feature[3], geom))
+    def intersects(self, tile):
+        """ True if the footprint of the tile intersects the area of interest, runs on the geoprocessing thread. """
+        epsg = SentinelImporter.getEPSG(tile)
+        if epsg is None:
+            return False
+        aoi = self.getAOI(epsg)
+        if not self.mayIntersect(tile):
+            return False
+        tileInfo = SentinelImporter.getTileInfo(tile)
+        return not aoi.disjoint(arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in tileInfo.footprint]), arcpy.SpatialReference(epsg)))
+
+    def accepts(self, tile, exact=True):
+        """ With exact False the area of interest is only tested with mayIntersect, the exact test (intersects)
+        is left to the caller. """
+        if self.tiles is not None and SentinelImporter.getGroupName(tile) not in self.tiles:
+            return False
+        if self.aoi is not None and not (self.intersects(tile) if exact else self.mayIntersect(tile)):
+            return False
+        if self.dateFrom is None and self.dateTo is None and self.maxCloudCoverage is None and self.minVegetationPercentage is None:
+            return True
+        record = SentinelImporter.getCatalogRecord(tile)
+        if record is None:
+            return False
+        sensingDate = (record.sensingTime or "")[:10]
+        if self.dateFrom is not None and sensingDate < self.dateFrom:
+            return False
+        if self.dateTo is not None and sensingDate > self.dateTo:
+            return False
+        if self.maxCloudCoverage is not None and (record.cloudCoverage is None or record.cloudCoverage > self.maxCloudCoverage):
+            return False
+        if self.minVegetationPercentage is not None and (record.vegetationPercentage is None or record.vegetationPercentage < self.minVegetationPercentage):
+            return False
+        return True
+
+class TileIndex(object):
+    """ In-memory STR-tree over the bounding boxes of the tile footprints from tileInfo.json, one tree per EPSG
+    code of the footprints. The leaves are packed sort-tile-recursive (slices along x, sorted along y within a
+    slice), upper levels group consecutive nodes. Every level is a numpy array of (xmin, ymin, xmax, ymax), node i
+    covers the entries i * nodeCapacity to (i + 1) * nodeCapacity - 1 of the level below. """
+
+    def __init__(self, tiles, nodeCapacity=16):
+        self.nodeCapacity = nodeCapacity
+        # EPSG code -> (tiles in leaf order, levels from the leaves up to the root)
+        self.trees = {}
+        groups = {}
+        for tile in tiles:
+            tileInfo = SentinelImporter.getTileInfo(tile)
+            epsg = SentinelImporter.getEPSG(tile)
+            if tileInfo is None or epsg is None or not tileInfo.footprint:
+                continue
+            footprint = numpy.array(tileInfo.footprint, dtype=float)
+            group = groups.setdefault(epsg, ([], []))
+            group[0].append(tile)
+            group[1].append(numpy.concatenate((footprint.min(axis=0), footprint.max(axis=0))))
+        for epsg, (groupTiles, boxes) in groups.items():
+            self.trees[epsg] = self.build(groupTiles, numpy.array(boxes))
+
+    def build(self, tiles, boxes):
+        capacity = self.nodeCapacity
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        sliceSize = int(numpy.ceil(numpy.sqrt(numpy.ceil(len(boxes) / capacity)))) * capacity
+        order = numpy.argsort(centers[:, 0], kind="mergesort")
+        for start in range(0, len(order), sliceSize):
+            part = order[start:start + sliceSize]
+            order[start:start + sliceSize] = part[numpy.argsort(centers[part, 1], kind="mergesort")]
+        levels = [boxes[order]]
+        while len(levels[-1]) > 1:
+            level = levels[-1]
+            starts = numpy.arange(0, len(level), capacity)
+            levels.append(numpy.concatenate((numpy.minimum.reduceat(level[:, :2], starts),
+                                             numpy.maximum.reduceat(level[:, 2:], starts)), axis=1))
+        return ([tiles[i] for i in order], levels)
+
+    def query(self, epsg, xmin, ymin, xmax, ymax):
+        """ Returns the tiles with footprints in epsg whose bounding box intersects the box. """
+        if epsg not in self.trees:
+            return []
+        tiles, levels = self.trees[epsg]
+        candidates = numpy.zeros(1, dtype=int)
+        for depth in range(len(levels) - 1, -1, -1):
+            boxes = levels[depth][candidates]
+            candidates = candidates[(boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) & (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin)]
+            if depth > 0:
+                candidates = (candidates[:, None] * self.nodeCapacity + numpy.arange(self.nodeCapacity)).ravel()
+                candidates = candidates[candidates < len(levels[depth - 1])]
+        return [tiles[i] for i in candidates]
+
+    def select(self, tileFilter):
+        """ Returns the tiles whose bounding box intersects the extent of the area of interest of tileFilter. """
+        selectedTiles = []
+        for epsg in self.trees:
+            extent = tileFilter.getAOI(epsg).extent
+            selectedTiles.extend(self.query(epsg, extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+        return selectedTiles
+
+class ImportJournal(object):
+    """ Checkpoint journal of an import. Every state change of a tile (pending, completed, failed) is appended
+    as a JSON line and flushed, so the journal survives an interrupted import; the last line of a tile wins. """
+
+    def __init__(self, journalFile):
+        self.journalFile = journalFile
+        self.tiles = {}
+        if os.path.exists(journalFile):
+            with open(journalFile, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line of a killed import may be incomplete
+                        continue
+                    self.tiles[record["tile"]] = (record["state"], record.get("attempts", 0))
+
+    def getState(self, tile):
+        """ Returns "pending", "completed", "failed" or None for a tile that is not in the journal. """
+        return self.tiles.get(os.path.abspath(tile), (None, 0))[0]
+
+    def record(self, tiles, state):
+        if not tiles:
+            return
+        with open(self.journalFile, "a") as f:
+            for tile in tiles:
+                path = os.path.abspath(tile)
+                attempts = self.tiles.get(path, (None, 0))[1] + (1 if state in ("completed", "failed") else 0)
+                self.tiles[path] = (state, attempts)
+                f.write(json.dumps({"tile": path, "state": state, "attempts": attempts}) + "\n")
+            f.flush()
+
+    def selectTiles(self, tiles):
+        """ Returns the tiles that are not completed. """
+        return [tile for tile in tiles if self.getState(tile) != "completed"]
+
+    def report(self):
+        counts = {}
+        for state, attempts in self.tiles.values():
+            counts[state] = counts.get(state, 0) + 1
+        print("Journal {0}: {1} completed, {2} failed, {3} pending.".format(
+              self.journalFile, counts.get("completed", 0), counts.get("failed", 0), counts.get("pending", 0)))
+
+class ImportTelemetry(object):
+    """ Stage times of an import written as JSON lines to telemetryFile, one record per tile with the time spent
+    in addRasters, maskParse and maskInsert, its status and the captured exception of a failed tile. Tiles are
+    identified by their folder. The raster type appends a record per built item (metadata, tileInfo, worldFiles
+    and build time) to the same file, summary() aggregates both. """
+    current = None
+
+    def __init__(self, telemetryFile):
+        self.telemetryFile = telemetryFile
+        self.lock = threading.Lock()
+        self.begin()
+
+    def begin(self):
+        """ Starts a new import, summary() covers the records written from now on. """
+        with self.lock:
+            self.tiles = {}
+            self.started = time.perf_counter()
+            self.offset = os.path.getsize(self.telemetryFile) if os.path.exists(self.telemetryFile) else 0
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with open(self.telemetryFile, "a") as f:
+                f.write(line)
+
+    def addTime(self, tiles, stage, seconds):
+        with self.lock:
+            for tile in tiles:
+                stages = self.tiles.setdefault(getTileFolder(tile), {"stages": {}})["stages"]
+                stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def addError(self, tile, stage, exception):
+        with self.lock:
+            self.tiles.setdefault(getTileFolder(tile), {"stages": {}})["error"] = {
+                "stage": stage, "type": type(exception).__name__, "message": str(exception),
+                "traceback": "".join(traceback.format_exception(type(exception), exception, exception.__traceback__))}
+
+    def finish(self, tiles, status):
+        for tile in tiles:
+            folder = getTileFolder(tile)
+            with self.lock:
+                record = self.tiles.pop(folder, {"stages": {}})
+            record.update({"source": "importer", "tile": folder, "status": status})
+            self.write(record)
+
+    def summary(self):
+        """ Writes and prints p50/p95/total of every stage and the throughput of the import, returns the summary record.
+        A tile is counted by its last status, so a tile failed and then added by a retry counts as processed. """
+        seconds = time.perf_counter() - self.started
+        times = {}
+        tileStatus = {}
+        with open(self.telemetryFile, "r") as f:
+            f.seek(self.offset)
+            for line in f:
+                record = json.loads(line)
+                if record.get("source") == "importer" and "status" in record:
+                    tileStatus[record.get("tile")] = record["status"]
+                for stage, value in record.get("stages", {}).items():
+                    times.setdefault(stage, []).append(value)
+        status = {"processed": 0, "failed": 0}
+        for value in tileStatus.values():
+            status[value] = status.get(value, 0) + 1
+        stages = {}
+        for stage, values in times.items():
+            p50, p95 = numpy.percentile(values, [50, 95])
+            stages[stage] = {"count": len(values), "p50": float(p50), "p95": float(p95), "total": float(sum(values))}
+        summary = {"source": "summary", "seconds": seconds, "processed": status["processed"], "failed": status["failed"],
+                   "tilesPerSecond": status["processed"] / seconds if seconds else 0.0, "stages": stages}
+        self.write(summary)
+        print("{0} tiles processed, {1} failed in {2:.1f}s ({3:.2f} tiles/s).".format(
+              summary["processed"], summary["failed"], seconds, summary["tilesPerSecond"]))
+        for stage in sorted(stages):
+            print("  {0}: p50 {1[p50]:.3f}s, p95 {1[p95]:.3f}s, total {1[total]:.3f}s".format(stage, stages[stage]))
+        return summary
+
+    @classmethod
+    def setCurrent(cls, telemetryFile):
+        """ Sets the telemetry of this process and the raster type (via SENTINEL2_TELEMETRY). """
+        os.environ[TELEMETRY_VARIABLE] = os.path.abspath(telemetryFile)
+        cls.current = ImportTelemetry(os.path.abspath(telemetryFile))
+        return cls.current
+
+    @classmethod
+    def start(cls, telemetryFile=None):
+        """ Called at the start of an import, telemetryFile replaces the current telemetry. """
+        if telemetryFile:
+            cls.setCurrent(telemetryFile)
+        elif cls.current is not None:
+            cls.current.begin()
+        return cls.current
+
+    @classmethod
+    def discoveryDone(cls, tiles, start):
+        if cls.current is not None:
+            cls.current.write({"source": "importer", "stage": "discovery", "tiles": len(tiles),
+                               "stages": {"discovery": time.perf_counter() - start}})
+
+    @classmethod
+    def stageDone(cls, tiles, stage, start):
+        """ Adds the time since start (time.perf_counter()) to stage, split evenly between the tiles. """
+        if cls.current is not None and tiles:
+            cls.current.addTime(tiles, stage, (time.perf_counter() - start) / len(tiles))
 
     @classmethod
-    def appendFeatures(cls, maskGmlFile, outputFeatureClass):
-        features = cls.parseFeatures(maskGmlFile)
-        cls.insertFeatures(features, outputFeatureClass)
+    def maintenanceDone(cls, mosaicDSName, stage, start):
+        if cls.current is not None:
+            cls.current.write({"source": "importer", "stage": "maintenance", "mosaicDataset": mosaicDSName,
+                               "stages": {stage: time.perf_counter() - start}})
+
+    @classmethod
+    def tileFailed(cls, tile, stage, exception):
+        if cls.current is not None:
+            cls.current.addError(tile, stage, exception)
+
+    @classmethod
+    def tilesDone(cls, processedTiles, failedTiles):
+        if cls.current is not None:
+            cls.current.finish(processedTiles, "processed")
+            cls.current.finish(failedTiles, "failed")
+
+    @classmethod
+    def finishImport(cls):
+        if cls.current is not None:
+            return cls.current.summary()
+
+class MosaicMaintenance(object):
+    """ Defers the maintenance of mosaic datasets to the end of an import. While registered, rasters are added
+    without updating cell size ranges, boundary, overviews and statistics (see getAddOptions). run() then updates
+    them once, only for the items added since the MosaicMaintenance was created (OBJECTID above the highest one
+    before) and, for overviews, the area of their footprints. The footprints themselves come from tileInfo.json through the
+    raster type and need no rebuild. """
+    # mosaic dataset -> MosaicMaintenance deferring it
+    deferred = {}
+
+    def __init__(self, mosaicDatasets):
+        self.maxOIDs = {}
+        for mosaicDSName in mosaicDatasets:
+            self.maxOIDs[mosaicDSName] = SentinelImporter.getMaxOID(mosaicDSName)
+            MosaicMaintenance.deferred[mosaicDSName] = self
+        self.done = set()
+
+    @classmethod
+    def getAddOptions(cls, mosaicDSName):
+        """ Keyword arguments of AddRastersToMosaicDataset for mosaicDSName. """
+        if mosaicDSName not in cls.deferred:
+            return {}
+        return {"update_cellsize_ranges": "NO_CELL_SIZES", "update_boundary": "NO_BOUNDARY",
+                "update_overviews": "NO_OVERVIEWS", "calculate_statistics": "NO_STATISTICS"}
+
+    def hasItems(self, mosaicDSName, where):
+        with arcpy.da.SearchCursor(mosaicDSName, ["OID@"], where) as cursor:
+            for row in cursor:
+                return True
+        return False
+
+    def runStage(self, mosaicDSName, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        ImportTelemetry.maintenanceDone(mosaicDSName, stage, start)
+        print("  {0}: {1:.1f}s".format(stage, time.perf_counter() - start))
+        return result
+
+    def run(self):
+        """ Updates cell size ranges, boundary (appended) and statistics for the new items and, if the mosaic
+        dataset has overviews, defines and builds the overviews covering their footprints. """
+        for mosaicDSName, maxOID in self.maxOIDs.items():
+            where = "OBJECTID > {0} AND Category = 1".format(maxOID)
+            self.done.add(mosaicDSName)
+            if not self.hasItems(mosaicDSName, where):
+                continue
+            print("Updating {0} for the items added ({1})...".format(mosaicDSName, where))
+            self.runStage(mosaicDSName, "cellSizeRanges", arcpy.management.CalculateCellSizeRanges, mosaicDSName, where,
+                          update_missing_only="UPDATE_MISSING_ONLY")
+            self.runStage(mosaicDSName, "boundary", arcpy.management.BuildBoundary, mosaicDSName, where, "APPEND")
+            self.runStage(mosaicDSName, "statistics", arcpy.management.BuildPyramidsandStatistics, mosaicDSName,
+                          build_pyramids="NONE", calculate_statistics="CALCULATE_STATISTICS", skip_existing="SKIP_EXISTING",
+                          where_clause=where)
+            footprints = "in_memory/S2NewFootprints"
+            self.runStage(mosaicDSName, "footprints", arcpy.management.ExportMosaicDatasetGeometry, mosaicDSName, footprints,
+                          where, "FOOTPRINT")
+            try:
+                if self.hasItems(mosaicDSName, "Category = 2"):
+                    self.runStage(mosaicDSName, "defineOverviews", arcpy.management.DefineOverviews, mosaicDSName,
+                                  in_template_dataset=footprints)
+                    self.runStage(mosaicDSName, "buildOverviews", arcpy.management.BuildOverviews, mosaicDSName,
+                                  define_missing_tiles="NO_DEFINE_MISSING_TILES", generate_overviews="GENERATE_OVERVIEWS",
+                                  generate_missing_images="GENERATE_MISSING_IMAGES", regenerate_stale_images="REGENERATE_STALE")
+            finally:
+                arcpy.management.Delete(footprints)
+
+    def close(self):
+        """ Ends the deferral, mosaic datasets not updated by run() are reported. """
+        for mosaicDSName, maxOID in self.maxOIDs.items():
+            if MosaicMaintenance.deferred.get(mosaicDSName) is self:
+                del MosaicMaintenance.deferred[mosaicDSName]
+            if mosaicDSName not in self.done:
+                print("Cell size ranges, boundary, statistics and overviews of {0} are not updated for the items with "
+                      "OBJECTID > {1}.".format(mosaicDSName, maxOID))
+
+class LocalStorage(object):
+    """ Tiles in a local or mounted folder. Same interface as S3Storage, fetching does nothing. """
+
+    def __init__(self, tilesFolder):
+        self.tilesFolder = tilesFolder
+
+    def iterTiles(self):
+        return SentinelImporter.iterTiles(self.tilesFolder)
+
+    def fetchTiles(self, tiles, files):
+        for tile in tiles:
+            yield (tile, None)
+
+class S3Storage(object):
+    """ Tiles in an S3 compatible object store, e.g. the sentinel-s2-l2a bucket or a MinIO server, listed with
+    ListObjectsV2 and read with GET. Objects are fetched into cacheFolder, which mirrors the bucket layout and
+    is used as read-through cache, so the importer and the raster type read local files. Requests are signed
+    (AWS signature version 4) when credentials are given or set in AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY. """
+
+    def __init__(self, endpoint, bucket, prefix="", cacheFolder=None, region="eu-central-1", accessKey=None, secretKey=None,
+                 sessionToken=None, requesterPays=False, workers=16, retries=3):
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cacheFolder = cacheFolder or os.path.join(tempfile.gettempdir(), "s2cache")
+        self.region = region
+        self.accessKey = accessKey or os.environ.get("AWS_ACCESS_KEY_ID")
+        self.secretKey = secretKey or os.environ.get("AWS_SECRET_ACCESS_KEY")
+        self.sessionToken = sessionToken or (os.environ.get("AWS_SESSION_TOKEN") if not accessKey else None)
+        self.requesterPays = requesterPays
+        self.workers = workers
+        self.retries = retries
+
+    def sign(self, method, path, query, headers):
+        """ Adds the AWS signature version 4 headers for an unsigned payload. """
+        now = datetime.datetime.utcnow()
+        amzDate = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = "{0}/{1}/s3/aws4_request".format(now.strftime("%Y%m%d"), self.region)
+        headers["x-amz-date"] = amzDate
+        headers["x-amz-content-sha256"] = "UNSIGNED-PAYLOAD"
+        if self.sessionToken:
+            headers["x-amz-security-token"] = self.sessionToken
+        names = sorted(name.lower() for name in headers)
+        values = dict((name.lower(), str(value).strip()) for name, value in headers.items())
+        canonicalQuery = "&".join("{0}={1}".format(urllib.parse.quote(k, safe="-_.~"), urllib.parse.quote(v, safe="-_.~"))
+                                  for k, v in sorted(query.items()))
+        canonicalRequest = "\n".join([method, urllib.parse.quote(path, safe="/-_.~"), canonicalQuery,
+                                      "".join("{0}:{1}\n".format(name, values[name]) for name in names),
+                                      ";".join(names), "UNSIGNED-PAYLOAD"])
+        stringToSign = "\n".join(["AWS4-HMAC-SHA256", amzDate, scope, hashlib.sha256(canonicalRequest.encode("utf-8")).hexdigest()])
+        key = ("AWS4" + self.secretKey).encode("utf-8")
+        for part in scope.split("/"):
+            key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+        signature = hmac.new(key, stringToSign.encode("utf-8"), hashlib.sha256).hexdigest()
+        headers["Authorization"] = "AWS4-HMAC-SHA256 Credential={0}/{1}, SignedHeaders={2}, Signature={3}".format(
+            self.accessKey, scope, ";".join(names), signature)
+
+    def open(self, key="", query=None):
+        """ Sends a GET request for key (path style) and returns the response. Failed requests are repeated
+        retries times with growing delay, except for client errors like 404. """
+        query = query or {}
+        path = "/{0}/{1}".format(self.bucket, key) if key else "/{0}".format(self.bucket)
+        url = self.endpoint + urllib.parse.quote(path, safe="/-_.~")
+        if query:
+            url += "?" + urllib.parse.urlencode(sorted(query.items()), quote_via=urllib.parse.quote)
+        for attempt in range(self.retries + 1):
+            headers = {"Host": urllib.parse.urlsplit(self.endpoint).netloc}
+            if self.requesterPays:
+                headers["x-amz-request-payer"] = "requester"
+            if self.accessKey and self.secretKey:
+                self.sign("GET", path, query, headers)
+            try:
+                return urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60)
+            except urllib.error.HTTPError as e:
+                if e.code < 500 or attempt == self.retries:
+                    raise
+            except OSError:
+                if attempt == self.retries:
+                    raise
+            time.sleep(2 ** attempt)
+
+    def listObjects(self, prefix):
+        """ Yields the keys below prefix, page by page. """
+        ns = {"s3": "http://s3.amazonaws.com/doc/2006-03-01/"}
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            with self.open("", query) as response:
+                root = ET.fromstring(response.read())
+            for key in root.iterfind("s3:Contents/s3:Key", ns):
+                yield key.text
+            token = root.findtext("s3:NextContinuationToken", None, ns)
+            if root.findtext("s3:IsTruncated", "false", ns) != "true" or not token:
+                return
+            query["continuation-token"] = token
+
+    def getLocalPath(self, key):
+        return os.path.join(self.cacheFolder, self.bucket, *key.split("/"))
+
+    def getKey(self, localPath):
+        return "/".join(os.path.relpath(localPath, os.path.join(self.cacheFolder, self.bucket)).split(os.sep))
+
+    def iterTiles(self):
+        """ Yields the local paths of the metadata.xml files in the bucket, nothing is fetched yet. """
+        for key in self.listObjects(self.prefix):
+            if key.endswith("/metadata.xml"):
+                yield self.getLocalPath(key)
+
+    def fetch(self, key):
+        """ Returns the local path of the object, fetched unless it is in the cache already. """
+        localPath = self.getLocalPath(key)
+        if os.path.exists(localPath):
+            return localPath
+        os.makedirs(os.path.dirname(localPath), exist_ok=True)
+        tempPath = "{0}.{1}.part".format(localPath, threading.get_ident())
+        with self.open(key) as response, open(tempPath, "wb") as f:
+            shutil.copyfileobj(response, f, 1048576)
+        os.replace(tempPath, localPath)
+        return localPath
+
+    def fetchTile(self, tile, files):
+        folder = self.getKey(os.path.dirname(tile))
+        for name in files:
+            self.fetch(folder + "/" + name)
+
+    def fetchTiles(self, tiles, files):
+        """ Fetches files (relative to the tile folder) of the tiles with workers threads, at most 2 * workers
+        tiles ahead of the consumer. Yields (tile, error) in the order of tiles, error is None for fetched tiles. """
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for tile in tiles:
+                pending.append((tile, executor.submit(self.fetchTile, tile, files)))
+                while len(pending) >= 2 * self.workers:
+                    yield self.getFetched(*pending.pop(0))
+            while pending:
+                yield self.getFetched(*pending.pop(0))
+
+    def getFetched(self, tile, future):
+        try:
+            future.result()
+            return (tile, None)
+        except Exception as e:
+            return (tile, e)
 
 class SentinelImporter(object):
 
@@ -80,49 +940,762 @@ class SentinelImporter(object):
         return workspace + "/" + mosaicDs
 
     @classmethod
-    def addTile(cls, mosaicDSName, tileMetadataPath, resolution="10m", cloudMaskFC=None):
+    def getRasterTypeName(cls, resolution="10m"):
         res = "20mCloud" if resolution == "20c" else resolution
-        arcpy.management.AddRastersToMosaicDataset(mosaicDSName, "Sentinel-2-L2A-" + res + "Tile", tileMetadataPath)
+        return "Sentinel-2-L2A-" + res + "Tile"
+
+    @classmethod
+    def getCloudMaskPath(cls, tileMetadataPath):
+        return os.path.join(tileMetadataPath[:-12], "qi", "MSK_CLOUDS_B00.gml")
+
+    @classmethod
+    def getMaxOID(cls, mosaicDSName):
+        """ Returns the highest OBJECTID of the mosaic dataset items, 0 if it is empty. """
+        with arcpy.da.SearchCursor(mosaicDSName, ["OID@"], sql_clause=(None, "ORDER BY OBJECTID DESC")) as cursor:
+            for row in cursor:
+                return row[0]
+        return 0
+
+    @classmethod
+    def getMissingTiles(cls, mosaicDSName, tiles, maxOID, excludeDuplicates=False):
+        """ Returns the tiles without a new item (OBJECTID > maxOID) in the mosaic dataset. AddRastersToMosaicDataset
+        only warns about rasters it fails to build. With excludeDuplicates items added before also count, they
+        were skipped as duplicates. Tiles without product name can't be checked and count as added. """
+        with arcpy.da.SearchCursor(mosaicDSName, ["ProductName"], "OBJECTID > {0}".format(maxOID)) as cursor:
+            loaded = set(row[0] for row in cursor)
+        missingTiles = [tile for tile in tiles if cls.getProductName(tile) and cls.getProductName(tile) not in loaded]
+        if excludeDuplicates and missingTiles:
+            products = [cls.getProductName(tile) for tile in missingTiles]
+            for i in range(0, len(products), 500):
+                where = "ProductName IN ({0})".format(",".join("'{0}'".format(product) for product in products[i:i + 500]))
+                with arcpy.da.SearchCursor(mosaicDSName, ["ProductName"], where) as cursor:
+                    loaded.update(row[0] for row in cursor)
+            missingTiles = [tile for tile in missingTiles if cls.getProductName(tile) not in loaded]
+        return missingTiles
+
+    @classmethod
+    def addTile(cls, mosaicDSName, tileMetadataPath, resolution="10m", cloudMaskFC=None, replaceMask=False, excludeDuplicates=False):
+        start = time.perf_counter()
+        maxOID = cls.getMaxOID(mosaicDSName)
+        if excludeDuplicates:
+            arcpy.management.AddRastersToMosaicDataset(mosaicDSName, cls.getRasterTypeName(resolution), tileMetadataPath,
+                    duplicate_items_action="EXCLUDE_DUPLICATES", **MosaicMaintenance.getAddOptions(mosaicDSName))
+        else:
+            arcpy.management.AddRastersToMosaicDataset(mosaicDSName, cls.getRasterTypeName(resolution), tileMetadataPath,
+                    **MosaicMaintenance.getAddOptions(mosaicDSName))
+        ImportTelemetry.stageDone([tileMetadataPath], "addRasters", start)
+        if cls.getMissingTiles(mosaicDSName, [tileMetadataPath], maxOID, excludeDuplicates):
+            raise RuntimeError("No mosaic dataset item was built for tile {0}".format(tileMetadataPath))
         if cloudMaskFC:
-            CloudMask.appendFeatures(os.path.join(tileMetadataPath[:-12], "qi", "MSK_CLOUDS_B00.gml"), cloudMaskFC)
+            CloudMask.appendFeatures(cls.getCloudMaskPath(tileMetadataPath), cloudMaskFC, replaceMask)
         print("Tile {0} added.".format(tileMetadataPath))
 
     @classmethod
-    def listTiles(cls, tilesFolder):
-        tiles = []
+    def addRasterBatch(cls, mosaicDSName, tiles, resolution="10m", isRetry=False):
+        """ Adds all tiles with a single AddRastersToMosaicDataset call. A failed batch is split in halves
+        which are retried (excluding duplicates), so a broken tile fails only itself. Tiles left without item
+        (AddRastersToMosaicDataset only warns about them) are retried the same way. Returns (addedTiles, failedTiles). """
+        start = time.perf_counter()
+        maxOID = cls.getMaxOID(mosaicDSName)
+        try:
+            if isRetry:
+                arcpy.management.AddRastersToMosaicDataset(mosaicDSName, cls.getRasterTypeName(resolution), list(tiles),
+                        duplicate_items_action="EXCLUDE_DUPLICATES", **MosaicMaintenance.getAddOptions(mosaicDSName))
+            else:
+                arcpy.management.AddRastersToMosaicDataset(mosaicDSName, cls.getRasterTypeName(resolution), list(tiles),
+                        **MosaicMaintenance.getAddOptions(mosaicDSName))
+        except Exception as e:
+            ImportTelemetry.stageDone(tiles, "addRasters", start)
+            if len(tiles) == 1:
+                print("Unable to add tile {0}\n{1}".format(tiles[0], e))
+                ImportTelemetry.tileFailed(tiles[0], "addRasters", e)
+                return ([], list(tiles))
+            print("Batch of {0} tiles failed, splitting...".format(len(tiles)))
+            half = len(tiles) // 2
+            first = cls.addRasterBatch(mosaicDSName, tiles[:half], resolution, True)
+            second = cls.addRasterBatch(mosaicDSName, tiles[half:], resolution, True)
+            return (first[0] + second[0], first[1] + second[1])
+        ImportTelemetry.stageDone(tiles, "addRasters", start)
+        missingTiles = cls.getMissingTiles(mosaicDSName, tiles, maxOID, isRetry)
+        if not missingTiles:
+            return (list(tiles), [])
+        addedTiles = [tile for tile in tiles if tile not in missingTiles]
+        if len(tiles) == 1:
+            print("No mosaic dataset item was built for tile {0}".format(tiles[0]))
+            ImportTelemetry.tileFailed(tiles[0], "addRasters", RuntimeError("No mosaic dataset item was built"))
+            return ([], list(tiles))
+        print("{0} of {1} tiles were not added, retrying...".format(len(missingTiles), len(tiles)))
+        half = (len(missingTiles) + 1) // 2
+        first = cls.addRasterBatch(mosaicDSName, missingTiles[:half], resolution, True)
+        second = cls.addRasterBatch(mosaicDSName, missingTiles[half:], resolution, True) if missingTiles[half:] else ([], [])
+        return (addedTiles + first[0] + second[0], first[1] + second[1])
+
+    @classmethod
+    def appendCloudMasks(cls, tiles, cloudMaskFC, replaceMasks=False):
+        """ Appends the cloud masks of the tiles, returns (processedTiles, failedTiles). """
+        processedTiles = []
+        failedTiles = []
+        for tile in tiles:
+            try:
+                if cloudMaskFC:
+                    CloudMask.appendFeatures(cls.getCloudMaskPath(tile), cloudMaskFC, replaceMasks)
+                processedTiles.append(tile)
+            except Exception as e:
+                print("Unable to add cloud mask of tile {0}\n{1}".format(tile, e))
+                ImportTelemetry.tileFailed(tile, "mask", e)
+                failedTiles.append(tile)
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def addTileBatch(cls, mosaicDSName, tiles, resolution="10m", cloudMaskFC=None, replaceMasks=False, excludeDuplicates=False):
+        """ Adds the tiles with addRasterBatch and appends their cloud masks. Returns (processedTiles, failedTiles). """
+        addedTiles, failedTiles = cls.addRasterBatch(mosaicDSName, tiles, resolution, excludeDuplicates)
+        processedTiles, failedMasks = cls.appendCloudMasks(addedTiles, cloudMaskFC, replaceMasks)
+        print("{0} tiles added.".format(len(processedTiles)))
+        return (processedTiles, failedTiles + failedMasks)
+
+    @classmethod
+    def iterTiles(cls, tilesFolder):
+        """ Yields the metadata.xml files below tilesFolder while the folders are walked. """
         for (dirpath, dirnames, filenames) in os.walk(tilesFolder):
             for filename in filenames:
                 if filename.lower() == "metadata.xml":
-                    tiles.append(os.path.join(dirpath, filename))
+                    yield os.path.join(dirpath, filename)
+
+    @classmethod
+    def listTiles(cls, tilesFolder):
+        start = time.perf_counter()
+        tiles = list(cls.iterTiles(tilesFolder))
+        ImportTelemetry.discoveryDone(tiles, start)
         return tiles
 
     @classmethod
-    def addTiles(cls, mosaicDSName, tiles, resolution="10m", cloudMaskFC=None):
+    def addTiles(cls, mosaicDSName, tiles, resolution="10m", cloudMaskFC=None, batchSize=1, replaceMasks=False, maskGeneralization=None,
+                 journal=None, excludeDuplicates=False):
+        """ With batchSize > 1 the tiles are added in chunks of batchSize tiles per AddRastersToMosaicDataset call.
+        Cloud masks of all tiles are written through one CloudMaskWriter, generalized by maskGeneralization.
+        The result of every chunk (or tile) is recorded in the optional ImportJournal. """
         processedTiles = []
         failedTiles = []
-        for tile in tiles:
+        cloudMaskWriter = CloudMaskWriter(cloudMaskFC, maskGeneralization) if cloudMaskFC else None
+        try:
+            if batchSize > 1:
+                for i in range(0, len(tiles), batchSize):
+                    batch = tiles[i:i + batchSize]
+                    print("Adding tiles {0}-{1} of {2}...".format(i + 1, i + len(batch), len(tiles)))
+                    processed, failed = cls.addTileBatch(mosaicDSName, batch, resolution, cloudMaskWriter, replaceMasks, excludeDuplicates)
+                    ImportTelemetry.tilesDone(processed, failed)
+                    if journal:
+                        # masks of completed tiles must be committed, resume skips them
+                        if cloudMaskWriter:
+                            cloudMaskWriter.flush()
+                        journal.record(processed, "completed")
+                        journal.record(failed, "failed")
+                    processedTiles.extend(processed)
+                    failedTiles.extend(failed)
+                return (processedTiles, failedTiles)
+
+            for tile in tiles:
+                try:
+                    print("Adding tile {0}...".format(tile))
+                    cls.addTile(mosaicDSName, tile, resolution, cloudMaskWriter, replaceMasks, excludeDuplicates)
+                    ImportTelemetry.tilesDone([tile], [])
+                    if journal:
+                        if cloudMaskWriter:
+                            cloudMaskWriter.flush()
+                        journal.record([tile], "completed")
+                    processedTiles.append(tile)
+                except Exception as e:
+                    print("Unable to add tile {0}\n{1}".format(tile, e))
+                    ImportTelemetry.tileFailed(tile, "addTile", e)
+                    ImportTelemetry.tilesDone([], [tile])
+                    if journal:
+                        journal.record([tile], "failed")
+                    failedTiles.append(tile)
+            return (processedTiles, failedTiles)
+        finally:
+            if cloudMaskWriter:
+                cloudMaskWriter.close()
+
+    @classmethod
+    def addTilesWithRetry(cls, mosaicDSName, tiles, resolution="10m", cloudMaskFC=None, batchSize=1, replaceMasks=False,
+                          maskGeneralization=None, journal=None, retries=0, retryDelay=10.0, excludeDuplicates=False):
+        """ addTiles, then the failed tiles are retried up to retries times, the first time after retryDelay seconds,
+        every next time after twice as long. Retries exclude duplicate rasters and replace cloud masks, so a tile
+        that failed half way is not added twice. """
+        if journal:
+            journal.record([tile for tile in tiles if journal.getState(tile) is None], "pending")
+        processedTiles, failedTiles = cls.addTiles(mosaicDSName, tiles, resolution, cloudMaskFC, batchSize, replaceMasks,
+                                                   maskGeneralization, journal, excludeDuplicates)
+        for attempt in range(1, retries + 1):
+            if not failedTiles:
+                break
+            delay = retryDelay * 2 ** (attempt - 1)
+            print("Retrying {0} failed tiles in {1:.0f}s (attempt {2} of {3})...".format(len(failedTiles), delay, attempt, retries))
+            time.sleep(delay)
+            processed, failedTiles = cls.addTiles(mosaicDSName, failedTiles, resolution, cloudMaskFC, batchSize, True,
+                                                  maskGeneralization, journal, True)
+            processedTiles.extend(processed)
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def importTiles(cls, tilesFolder, mosaicDSName, resolution="10m", cloudMaskFC=None, batchSize=1, cacheFile=None,
+                    incremental=False, manifestFile=None, maskGeneralization=None, telemetryFile=None,
+                    journalFile=None, resume=False, retries=0, retryDelay=10.0, tileFilter=None, deduplicate=False,
+                    deferMaintenance=False):
+        """ cacheFile is a SQLite file keeping the values extracted from the tiles between imports.
+        With incremental only tiles that are not in the mosaic dataset yet, or changed since they were recorded
+        in manifestFile, are added. maskGeneralization is an optional MaskGeneralization for the cloud masks.
+        telemetryFile is a JSON lines file receiving the stage times of every tile (see ImportTelemetry).
+        journalFile records completed, failed and pending tiles (see ImportJournal); with resume the tiles
+        completed by an earlier run are skipped. Failed tiles are retried retries times (see addTilesWithRetry).
+        Only tiles accepted by the optional TileFilter are imported, with deduplicate only the newest processing
+        baseline of every MGRS tile and sensing time (see deduplicateTiles). With deferMaintenance cell size ranges,
+        boundary, statistics and overviews are updated once at the end, for the new items only (see MosaicMaintenance). """
+        if cacheFile:
+            TileCache.setCurrent(cacheFile)
+        ImportTelemetry.start(telemetryFile)
+        tiles = cls.filterTiles(cls.listTiles(tilesFolder), tileFilter)
+        if deduplicate:
+            tiles = cls.deduplicateTiles(tiles)[0]
+        journal = ImportJournal(journalFile) if journalFile else None
+        if journal and resume:
+            count = len(tiles)
+            tiles = journal.selectTiles(tiles)
+            print("Resuming import, {0} of {1} tiles completed before.".format(count - len(tiles), count))
+
+        manifest = None
+        replaceMasks = resume
+        if incremental:
+            manifest = ImportManifest(manifestFile) if manifestFile else None
+            newTiles, changedTiles = cls.selectNewTiles(mosaicDSName, tiles, manifest)
+            print("{0} new and {1} changed of {2} tiles.".format(len(newTiles), len(changedTiles), len(tiles)))
+            cls.removeTiles(mosaicDSName, changedTiles)
+            tiles = newTiles + changedTiles
+            replaceMasks = True
+
+        maintenance = MosaicMaintenance([mosaicDSName]) if deferMaintenance else None
+        try:
+            # tiles of an interrupted run may have been added partially
+            processedTiles, failedTiles = cls.addTilesWithRetry(mosaicDSName, tiles, resolution, cloudMaskFC, batchSize, replaceMasks,
+                                                                maskGeneralization, journal, retries, retryDelay, resume)
+            if maintenance:
+                maintenance.run()
+        finally:
+            if maintenance:
+                maintenance.close()
+        if manifest:
+            manifest.add(processedTiles)
+            manifest.save()
+        if journal:
+            journal.report()
+        ImportTelemetry.finishImport()
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def addTilesMultiResolution(cls, mosaicDatasets, tiles, cloudMaskFC=None, batchSize=1, maskGeneralization=None):
+        """ mosaicDatasets maps resolutions (10m, 20m, 20c) to mosaic datasets. Every batch of tiles is added to all
+        of them in turn, so the values the raster type extracted from a tile are still cached for the next
+        resolution; the cloud mask is appended once. A tile is processed if it was added to all mosaic datasets. """
+        processedTiles = []
+        failedTiles = []
+        batchSize = max(batchSize, 1)
+        cloudMaskWriter = CloudMaskWriter(cloudMaskFC, maskGeneralization) if cloudMaskFC else None
+        try:
+            for i in range(0, len(tiles), batchSize):
+                batch = tiles[i:i + batchSize]
+                print("Adding tiles {0}-{1} of {2}...".format(i + 1, i + len(batch), len(tiles)))
+                failed = set()
+                for resolution, mosaicDSName in mosaicDatasets.items():
+                    failed.update(cls.addRasterBatch(mosaicDSName, batch, resolution)[1])
+                processed, failedMasks = cls.appendCloudMasks([tile for tile in batch if tile not in failed], cloudMaskWriter)
+                failed = [tile for tile in batch if tile in failed] + failedMasks
+                ImportTelemetry.tilesDone(processed, failed)
+                processedTiles.extend(processed)
+                failedTiles.extend(failed)
+        finally:
+            if cloudMaskWriter:
+                cloudMaskWriter.close()
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def importTilesMultiResolution(cls, tilesFolder, mosaicDatasets, cloudMaskFC=None, batchSize=1, cacheFile=None,
+                                   maskGeneralization=None, telemetryFile=None, tileFilter=None, deduplicate=False,
+                                   deferMaintenance=False):
+        """ Walks tilesFolder once and loads every tile into the mosaic datasets of all resolutions in mosaicDatasets,
+        e.g. {"10m": "E:/S2.gdb/S2-10m", "20m": "E:/S2.gdb/S2-20m", "20c": "E:/S2.gdb/S2-20c"}. """
+        if cacheFile:
+            TileCache.setCurrent(cacheFile)
+        ImportTelemetry.start(telemetryFile)
+        tiles = cls.filterTiles(cls.listTiles(tilesFolder), tileFilter)
+        if deduplicate:
+            tiles = cls.deduplicateTiles(tiles)[0]
+        maintenance = MosaicMaintenance(mosaicDatasets.values()) if deferMaintenance else None
+        try:
+            processedTiles, failedTiles = cls.addTilesMultiResolution(mosaicDatasets, tiles, cloudMaskFC, batchSize, maskGeneralization)
+            if maintenance:
+                maintenance.run()
+        finally:
+            if maintenance:
+                maintenance.close()
+        ImportTelemetry.finishImport()
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def prepareTile(cls, tile, resolution="10m", readMask=False, generalization=None, tileFilter=None):
+        """ Everything of a tile that only reads files, run on the preparation threads of importTilesPipelined:
+        filter, sidecar checks, tileInfo.json, read-ahead of metadata.xml and the cloud mask. Returns a PreparedTile. """
+        start = time.perf_counter()
+        try:
+            # only the bounding box of an area of interest is tested here, the exact test makes arcpy calls
+            if tileFilter is not None and not tileFilter.accepts(tile, False):
+                return PreparedTile(tile, False, None, None)
+            folder = os.path.dirname(tile)
+            for sidecar in ("tileInfo.json", "R" + resolution.replace("c", "m")):
+                if not os.path.exists(os.path.join(folder, sidecar)):
+                    raise OSError("{0} is missing in {1}".format(sidecar, folder))
+            cls.getTileInfo(tile)
+            # the raster type reads metadata.xml from the file system cache then
+            with open(tile, "rb") as f:
+                while f.read(1048576):
+                    pass
+            mask = None
+            if readMask:
+                maskStart = time.perf_counter()
+                mask = CloudMask.readCoordinates(cls.getCloudMaskPath(tile), copy.copy(generalization) if generalization else None)
+                ImportTelemetry.stageDone([tile], "maskParse", maskStart)
+            ImportTelemetry.stageDone([tile], "prepare", start)
+            return PreparedTile(tile, True, mask, None)
+        except Exception as e:
+            return PreparedTile(tile, True, None, e)
+
+    @classmethod
+    def addPreparedBatch(cls, mosaicDSName, batch, resolution="10m", cloudMaskWriter=None):
+        """ Adds a batch of PreparedTiles with addRasterBatch and inserts their cloud masks. Returns (processedTiles, failedTiles). """
+        addedTiles, failedTiles = cls.addRasterBatch(mosaicDSName, [item.tile for item in batch], resolution)
+        addedTiles = set(addedTiles)
+        processedTiles = []
+        for item in batch:
+            if item.tile not in addedTiles:
+                continue
             try:
-                print("Adding tile {0}...".format(tile))
-                cls.addTile(mosaicDSName, tile, resolution, cloudMaskFC)
-                processedTiles.append(tile)
+                if cloudMaskWriter and item.mask:
+                    start = time.perf_counter()
+                    cloudMaskWriter.insertFeatures(CloudMask.createFeatures(item.mask))
+                    ImportTelemetry.stageDone([item.tile], "maskInsert", start)
+                processedTiles.append(item.tile)
             except Exception as e:
+                print("Unable to add cloud mask of tile {0}\n{1}".format(item.tile, e))
+                ImportTelemetry.tileFailed(item.tile, "mask", e)
+                failedTiles.append(item.tile)
+        print("{0} tiles added.".format(len(processedTiles)))
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def importTilesPipelined(cls, tilesFolder, mosaicDSName, resolution="10m", cloudMaskFC=None, batchSize=50, workers=8,
+                             cacheFile=None, maskGeneralization=None, telemetryFile=None, tileFilter=None, deferMaintenance=False):
+        """ Streaming import: folders are walked while tiles are imported, workers threads prepare the tiles
+        (see prepareTile) and this thread only runs the geoprocessing calls, the exact area of interest test and
+        cursor inserts, batchSize tiles per AddRastersToMosaicDataset call. At most 2 * batchSize tiles are prepared ahead, so memory does not
+        grow with the size of the archive. """
+        if cacheFile:
+            TileCache.setCurrent(cacheFile)
+        ImportTelemetry.start(telemetryFile)
+        batchSize = max(batchSize, 1)
+        slots = threading.Semaphore(2 * batchSize)
+        prepared = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for tile in cls.iterTiles(tilesFolder):
+                        while not slots.acquire(timeout=1):
+                            if stop.is_set():
+                                return
+                        if stop.is_set():
+                            return
+                        future = executor.submit(cls.prepareTile, tile, resolution, bool(cloudMaskFC), maskGeneralization, tileFilter)
+                        future.add_done_callback(lambda f: prepared.put(f.result()))
+            finally:
+                prepared.put(None)
+
+        processedTiles = []
+        failedTiles = []
+        skippedTiles = 0
+        cloudMaskWriter = CloudMaskWriter(cloudMaskFC) if cloudMaskFC else None
+        maintenance = MosaicMaintenance([mosaicDSName]) if deferMaintenance else None
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            batch = []
+            while True:
+                item = prepared.get()
+                if item is not None:
+                    slots.release()
+                    if not item.accepted or (item.error is None and tileFilter is not None and tileFilter.aoi is not None and
+                                             not tileFilter.intersects(item.tile)):
+                        skippedTiles += 1
+                        continue
+                    if item.error is not None:
+                        print("Unable to prepare tile {0}\n{1}".format(item.tile, item.error))
+                        ImportTelemetry.tileFailed(item.tile, "prepare", item.error)
+                        ImportTelemetry.tilesDone([], [item.tile])
+                        failedTiles.append(item.tile)
+                        continue
+                    batch.append(item)
+                if batch and (item is None or len(batch) >= batchSize):
+                    print("Adding tiles {0}-{1}...".format(len(processedTiles) + len(failedTiles) + 1,
+                                                           len(processedTiles) + len(failedTiles) + len(batch)))
+                    processed, failed = cls.addPreparedBatch(mosaicDSName, batch, resolution, cloudMaskWriter)
+                    ImportTelemetry.tilesDone(processed, failed)
+                    processedTiles.extend(processed)
+                    failedTiles.extend(failed)
+                    batch = []
+                if item is None:
+                    break
+            if maintenance:
+                maintenance.run()
+        finally:
+            stop.set()
+            if cloudMaskWriter:
+                cloudMaskWriter.close()
+            if maintenance:
+                maintenance.close()
+        producer.join()
+        if tileFilter is not None:
+            print("{0} tiles skipped by the filter.".format(skippedTiles))
+        ImportTelemetry.finishImport()
+        return (processedTiles, failedTiles)
+
+    @classmethod
+    def fetchTiles(cls, storage, tiles, files):
+        """ Fetches files of the tiles from storage, returns (fetchedTiles, failedTiles). """
+        fetchedTiles = []
+        failedTiles = []
+        for tile, error in storage.fetchTiles(tiles, files):
+            if error is None:
+                fetchedTiles.append(tile)
+            else:
+                print("Unable to fetch tile {0}\n{1}".format(tile, error))
+                ImportTelemetry.tileFailed(tile, "fetch", error)
+                ImportTelemetry.tilesDone([], [tile])
                 failedTiles.append(tile)
+        return (fetchedTiles, failedTiles)
+
+    @classmethod
+    def importTilesFromStorage(cls, storage, mosaicDSName, resolution="10m", cloudMaskFC=None, batchSize=1, cacheFile=None,
+                               maskGeneralization=None, telemetryFile=None, tileFilter=None, deduplicate=False,
+                               deferMaintenance=False):
+        """ Imports the tiles of a LocalStorage or S3Storage. metadata.xml and tileInfo.json of all tiles are
+        fetched first, the filter and deduplication run on them, and the band files and cloud mask are fetched
+        for the selected tiles only. """
+        if cacheFile:
+            TileCache.setCurrent(cacheFile)
+        ImportTelemetry.start(telemetryFile)
+        start = time.perf_counter()
+        tiles, failedTiles = cls.fetchTiles(storage, storage.iterTiles(), TILE_METADATA_FILES)
+        ImportTelemetry.discoveryDone(tiles, start)
+        tiles = cls.filterTiles(tiles, tileFilter)
+        if deduplicate:
+            tiles = cls.deduplicateTiles(tiles)[0]
+        files = BAND_FILES[resolution] + (["qi/MSK_CLOUDS_B00.gml"] if cloudMaskFC else [])
+        tiles, failed = cls.fetchTiles(storage, tiles, files)
+        failedTiles.extend(failed)
+        maintenance = MosaicMaintenance([mosaicDSName]) if deferMaintenance else None
+        try:
+            processedTiles, failed = cls.addTiles(mosaicDSName, tiles, resolution, cloudMaskFC, batchSize, False, maskGeneralization)
+            failedTiles.extend(failed)
+            if maintenance:
+                maintenance.run()
+        finally:
+            if maintenance:
+                maintenance.close()
+        ImportTelemetry.finishImport()
         return (processedTiles, failedTiles)
 
     @classmethod
-    def importTiles(cls, tilesFolder, mosaicDSName, resolution="10m", cloudMaskFC=None):
-        tiles = cls.listTiles(tilesFolder)
-        return cls.addTiles(mosaicDSName, tiles, resolution, cloudMaskFC)
+    def getLoadedProducts(cls, mosaicDSName):
+        """ Returns the set of ProductName values of the mosaic dataset items. """
+        with arcpy.da.SearchCursor(mosaicDSName, ["ProductName"]) as cursor:
+            return set(row[0] for row in cursor if row[0])
+
+    @classmethod
+    def selectNewTiles(cls, mosaicDSName, tiles, manifest=None):
+        """ Returns (newTiles, changedTiles). Tiles recorded unchanged in manifest are skipped without reading
+        them, other tiles are new unless their product name is already loaded in the mosaic dataset. Loaded tiles
+        not in manifest yet (e.g. added by the toolbox) are recorded in it, so later runs only stat them. """
+        loadedProducts = cls.getLoadedProducts(mosaicDSName)
+        newTiles = []
+        changedTiles = []
+        loadedTiles = []
+        for tile in tiles:
+            state = manifest.getState(tile) if manifest else "new"
+            if state == "changed":
+                changedTiles.append(tile)
+            elif state == "new":
+                if cls.getProductName(tile) not in loadedProducts:
+                    newTiles.append(tile)
+                else:
+                    loadedTiles.append(tile)
+        if manifest:
+            manifest.add(loadedTiles)
+        return (newTiles, changedTiles)
+
+    @classmethod
+    def removeTiles(cls, mosaicDSName, tiles):
+        """ Removes the mosaic dataset items of the tiles, e.g. before changed tiles are added again. """
+        products = [product for product in (cls.getProductName(tile) for tile in tiles) if product]
+        for i in range(0, len(products), 500):
+            where = "ProductName IN ({0})".format(",".join("'{0}'".format(product) for product in products[i:i + 500]))
+            arcpy.management.RemoveRastersFromMosaicDataset(mosaicDSName, where)
 
-@lru_cache(maxsize=128)
-def cacheElementTree(path):
+    @classmethod
+    def getTileInfo(cls, tileMetadataPath):
+        """ Returns the TileInfo read from the tileInfo.json next to the metadata file or None. """
         try:
-            tree = ET.parse(path)
-        except ET.ParseError as e:
-            print("Exception while parsing {0}\n{1}".format(path,e))
+            tileInfoPath = os.path.join(os.path.dirname(os.path.abspath(tileMetadataPath)), "tileInfo.json")
+            stat = os.stat(tileInfoPath)
+            return cacheTileInfo(tileInfoPath, stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError):
             return None
 
-        return tree
+    @classmethod
+    def getProductName(cls, tileMetadataPath):
+        tileInfo = cls.getTileInfo(tileMetadataPath)
+        return tileInfo.productName if tileInfo else None
+
+    @classmethod
+    def getGroupName(cls, tileMetadataPath):
+        """ Returns the MGRS tile name (e.g. T34UDV) from the tileInfo.json next to the metadata file. """
+        tileInfo = cls.getTileInfo(tileMetadataPath)
+        return tileInfo.groupName if tileInfo else None
+
+    @classmethod
+    def getEPSG(cls, tileMetadataPath):
+        """ Returns the EPSG code of the tile footprint, WGS 84 / UTM of the MGRS tile (e.g. 32634 for T34UDV). """
+        groupName = cls.getGroupName(tileMetadataPath)
+        if not groupName or not groupName[1:-3].isdigit():
+            return None
+        return (32600 if groupName[-3].upper() >= "N" else 32700) + int(groupName[1:-3])
+
+    @classmethod
+    def getCatalogRecord(cls, tileMetadataPath):
+        """ Returns the CatalogRecord of the tile or None. Records are kept in the persistent TileCache. """
+        try:
+            stat = os.stat(tileMetadataPath)
+            return cacheCatalogRecord(os.path.abspath(tileMetadataPath), stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError, ET.ParseError) as e:
+            print("Unable to read {0}\n{1}".format(tileMetadataPath, e))
+            return None
+
+    @classmethod
+    def filterTiles(cls, tiles, tileFilter):
+        """ Returns the tiles accepted by tileFilter. """
+        if tileFilter is None:
+            return tiles
+        candidates = tiles
+        if tileFilter.aoi is not None:
+            # only the tiles in the extent of the area of interest are read and tested further
+            indexedTiles = set(TileIndex(tiles).select(tileFilter))
+            candidates = [tile for tile in tiles if tile in indexedTiles]
+            print("{0} of {1} tiles in the extent of the area of interest.".format(len(candidates), len(tiles)))
+        selectedTiles = [tile for tile in candidates if tileFilter.accepts(tile)]
+        print("{0} of {1} tiles selected by the filter.".format(len(selectedTiles), len(tiles)))
+        return selectedTiles
+
+    @classmethod
+    def getBaseline(cls, productName):
+        """ Returns the processing baseline (e.g. N0207) of a product name or an empty string. """
+        for part in (productName or "").split("_"):
+            if len(part) == 5 and part[0] == "N" and part[1:].isdigit():
+                return part
+        return ""
+
+    @classmethod
+    def deduplicateTiles(cls, tiles):
+        """ Keeps one tile per MGRS tile and sensing time, the one with the newest processing baseline (the
+        product name decides between equal baselines). Returns (keptTiles, droppedTiles), droppedTiles is a list
+        of (droppedTile, keptTile). Tiles without catalog record are kept. """
+        newest = {}
+        for tile in tiles:
+            record = cls.getCatalogRecord(tile)
+            if record is None or record.groupName is None or record.sensingTime is None:
+                continue
+            key = (record.groupName, record.sensingTime)
+            rank = (cls.getBaseline(record.productName), record.productName or "")
+            if key not in newest or rank > newest[key][0]:
+                newest[key] = (rank, tile)
+        keptTiles = []
+        droppedTiles = []
+        for tile in tiles:
+            record = cls.getCatalogRecord(tile)
+            if record is None or record.groupName is None or record.sensingTime is None:
+                keptTiles.append(tile)
+                continue
+            keptTile = newest[(record.groupName, record.sensingTime)][1]
+            if keptTile == tile:
+                keptTiles.append(tile)
+            else:
+                droppedTiles.append((tile, keptTile))
+        print("{0} duplicate tiles dropped.".format(len(droppedTiles)))
+        for droppedTile, keptTile in droppedTiles:
+            print("  {0} ({1}) replaced by {2} ({3})".format(droppedTile, cls.getBaseline(cls.getProductName(droppedTile)),
+                  keptTile, cls.getBaseline(cls.getProductName(keptTile))))
+        return (keptTiles, droppedTiles)
+
+    @classmethod
+    def partitionTiles(cls, tiles, partitionCount):
+        """ Splits tiles into at most partitionCount lists of similar size. Tiles of the same MGRS tile
+        are kept in one partition, so every staging mosaic dataset covers a compact area in one UTM zone. """
+        groups = {}
+        for tile in tiles:
+            groups.setdefault(cls.getGroupName(tile), []).append(tile)
+        partitions = [[] for i in range(min(partitionCount, len(groups)))]
+        for group in sorted(groups.values(), key=len, reverse=True):
+            min(partitions, key=len).extend(group)
+        return partitions
+
+    @classmethod
+    def importPartition(cls, stagingGDB, tiles, mosaicDSName, resolution="10m", cloudMaskFC=None, batchSize=1, maskGeneralization=None,
+                        telemetryFile=None):
+        """ Worker of importTilesParallel. Adds tiles to a new mosaic dataset (and cloud mask featureclass)
+        in stagingGDB with the spatial reference of the target datasets. """
+        if telemetryFile:
+            ImportTelemetry.setCurrent(telemetryFile)
+        folder, name = os.path.split(stagingGDB)
+        arcpy.management.CreateFileGDB(folder, name)
+        stagingMds = cls.createMosaicDataset(stagingGDB, "Staging", resolution, arcpy.Describe(mosaicDSName).spatialReference)
+        stagingFC = None
+        if cloudMaskFC:
+            stagingFC = CloudMask.createFeatureClass(stagingGDB, "CloudMask", arcpy.Describe(cloudMaskFC).spatialReference)
+        processedTiles, failedTiles = cls.addTiles(stagingMds, tiles, resolution, stagingFC, batchSize, False, maskGeneralization)
+        return (stagingMds, stagingFC, processedTiles, failedTiles)
+
+    @classmethod
+    def importTilesParallel(cls, tilesFolder, mosaicDSName, resolution="10m", cloudMaskFC=None, batchSize=1,
+                            workers=None, stagingFolder=None, keepStaging=False, cacheFile=None, maskGeneralization=None,
+                            telemetryFile=None, tileFilter=None, deduplicate=False, deferMaintenance=False):
+        """ Imports the tiles in worker processes, each into its own staging file geodatabase, and merges
+        the staging mosaic datasets and cloud masks into mosaicDSName and cloudMaskFC afterwards.
+        The workers write their telemetry to separate files which are appended to telemetryFile.
+        With deferMaintenance the maintenance of mosaicDSName runs once after all merges. """
+        if cacheFile:
+            TileCache.setCurrent(cacheFile)
+        telemetry = ImportTelemetry.start(telemetryFile)
+        tiles = cls.filterTiles(cls.listTiles(tilesFolder), tileFilter)
+        if deduplicate:
+            tiles = cls.deduplicateTiles(tiles)[0]
+        partitions = cls.partitionTiles(tiles, workers or os.cpu_count() or 1)
+        stagingFolder = stagingFolder or tempfile.mkdtemp(prefix="s2staging_")
+        processedTiles = []
+        failedTiles = []
+        mergedStaging = []
+        partitionTelemetry = [telemetry.telemetryFile + ".{0}".format(i) if telemetry else None for i in range(len(partitions))]
+        maintenance = MosaicMaintenance([mosaicDSName]) if deferMaintenance else None
+        try:
+            with ProcessPoolExecutor(max_workers=len(partitions) or 1) as executor:
+                futures = [(partition, executor.submit(cls.importPartition, os.path.join(stagingFolder, "stage{0}.gdb".format(i)),
+                                                       partition, mosaicDSName, resolution, cloudMaskFC, batchSize, maskGeneralization,
+                                                       partitionTelemetry[i]))
+                           for i, partition in enumerate(partitions)]
+                for partition, future in futures:
+                    try:
+                        stagingMds, stagingFC, processed, failed = future.result()
+                    except Exception as e:
+                        print("Partition of {0} tiles failed.\n{1}".format(len(partition), e))
+                        failedTiles.extend(partition)
+                        continue
+                    failedTiles.extend(failed)
+                    if not processed:
+                        continue
+                    try:
+                        print("Merging {0} tiles from {1}...".format(len(processed), stagingMds))
+                        arcpy.management.AddRastersToMosaicDataset(mosaicDSName, "Table / Raster Catalog", stagingMds,
+                                **MosaicMaintenance.getAddOptions(mosaicDSName))
+                        if stagingFC:
+                            arcpy.management.Append(stagingFC, cloudMaskFC, "NO_TEST")
+                        processedTiles.extend(processed)
+                    except Exception as e:
+                        print("Unable to merge {0}\n{1}".format(stagingMds, e))
+                        failedTiles.extend(processed)
+                        continue
+                    mergedStaging.append(os.path.dirname(stagingMds))
+            # the worker processes may hold locks on their staging geodatabases until the pool has shut down
+            if not keepStaging:
+                for stagingGDB in mergedStaging:
+                    try:
+                        arcpy.management.Delete(stagingGDB)
+                    except Exception as e:
+                        print("Unable to delete the staging geodatabase {0}\n{1}".format(stagingGDB, e))
+            if maintenance:
+                maintenance.run()
+        finally:
+            if maintenance:
+                maintenance.close()
+        for partitionFile in partitionTelemetry:
+            if partitionFile and os.path.exists(partitionFile):
+                with open(partitionFile, "r") as f:
+                    for line in f:
+                        telemetry.write(json.loads(line))
+                os.remove(partitionFile)
+        ImportTelemetry.finishImport()
+        return (processedTiles, failedTiles)
+
+def getTileFolder(path):
+    """ Telemetry key of a tile given by its metadata.xml or folder, the same key is used by the raster type. """
+    if os.path.basename(path).lower() == "metadata.xml":
+        path = os.path.dirname(path)
+    return os.path.normpath(os.path.abspath(path))
+
+def parseTileInfo(tileInfoPath):
+    with open(tileInfoPath, "r") as f:
+        tileInfo = json.load(f)
+    groupName = None
+    if "utmZone" in tileInfo and "latitudeBand" in tileInfo and "gridSquare" in tileInfo:
+        groupName = "T{0}{1}{2}".format(tileInfo["utmZone"], tileInfo["latitudeBand"], tileInfo["gridSquare"])
+    footprint = ()
+    if ("tileDataGeometry" in tileInfo) and ("coordinates" in tileInfo["tileDataGeometry"]):
+        footprint = tuple((vertex[0], vertex[1]) for vertex in tileInfo["tileDataGeometry"]["coordinates"][0])
+    return TileInfo(tileInfo.get("productName"), groupName, footprint)
+
+# the caches below are keyed by path, size and modification time, so a reprocessed tile is read again
+@lru_cache(maxsize=4096)
+def cacheTileInfo(tileInfoPath, size, mtime):
+    tileCache = TileCache.getCurrent()
+    if tileCache is None:
+        return parseTileInfo(tileInfoPath)
+    record = tileCache.load(tileInfoPath, "tileInfo", lambda p: parseTileInfo(p)._asdict())
+    return TileInfo(record["productName"], record["groupName"], tuple(tuple(vertex) for vertex in record["footprint"]))
+
+def parseCatalogRecord(tileMetadataPath):
+    """ Streams metadata.xml for sensing time, cloud coverage and vegetation percentage of the tile. """
+    values = {"SENSING_TIME": None, "CLOUD_COVERAGE_PERCENTAGE": None, "VEGETATION_PERCENTAGE": None}
+    stack = []
+    with open(tileMetadataPath, "rb") as f:
+        for event, element in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                continue
+            stack.pop()
+            name = element.tag.rsplit("}", 1)[-1]
+            if name == "SENSING_TIME" or (name in values and stack and stack[-1].tag.rsplit("}", 1)[-1] == "L2A_Image_Content_QI"):
+                values[name] = element.text
+            if stack:
+                stack[-1].remove(element)
+    tileInfoPath = os.path.join(os.path.dirname(tileMetadataPath), "tileInfo.json")
+    stat = os.stat(tileInfoPath)
+    tileInfo = cacheTileInfo(tileInfoPath, stat.st_size, stat.st_mtime_ns)
+    return CatalogRecord(tileInfo.productName, tileInfo.groupName, values["SENSING_TIME"],
+                         float(values["CLOUD_COVERAGE_PERCENTAGE"]) if values["CLOUD_COVERAGE_PERCENTAGE"] is not None else None,
+                         float(values["VEGETATION_PERCENTAGE"]) if values["VEGETATION_PERCENTAGE"] is not None else None)
+
+@lru_cache(maxsize=65536)
+def cacheCatalogRecord(tileMetadataPath, size, mtime):
+    tileCache = TileCache.getCurrent()
+    if tileCache is None:
+        return parseCatalogRecord(tileMetadataPath)
+    return CatalogRecord(**tileCache.load(tileMetadataPath, "catalog", lambda p: parseCatalogRecord(p)._asdict()))
 
 if __name__ == '__main__':
 
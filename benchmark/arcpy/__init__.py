@@ -0,0 +1,151 @@
+#------------------------------------------------------------------------------
+# Copyright 2018 ArcGEO
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+
+# Lightweight stand-in for the parts of arcpy used by the raster type and SentinelImporter.py, so their hot paths
+# can be measured without ArcGIS Pro. It is only found by scripts started from the benchmark folder.
+# Geoprocessing tools do nothing, except AddRastersToMosaicDataset which hands the rasters to addRastersHook
+# (see run.py) and records the items it returns, cursors count the inserted rows in insertedRows.
+# Search cursors return the recorded items and understand the where clauses used by SentinelImporter.py
+# ("OBJECTID > n" and "ProductName IN (...)").
+
+import re
+import types
+
+# function(mosaicDataset, rasterType, rasters) called by management.AddRastersToMosaicDataset,
+# returns the ProductName of every item built
+addRastersHook = None
+# featureclass -> number of rows inserted with da.InsertCursor
+insertedRows = {}
+# mosaic dataset -> items as {'OID@': ..., 'ProductName': ...}
+items = {}
+# factory code of the spatial reference returned by Describe
+describeFactoryCode = 32634
+
+env = types.SimpleNamespace(workspace=None, overwriteOutput=False)
+
+
+class ExecuteError(Exception):
+    pass
+
+
+class SpatialReference(object):
+    def __init__(self, item=None):
+        self.factoryCode = item if isinstance(item, int) else 0
+        self.name = str(item)
+
+
+class Point(object):
+    def __init__(self, X=0.0, Y=0.0):
+        self.X = X
+        self.Y = Y
+
+
+class Array(list):
+    def add(self, item):
+        self.append(item)
+
+
+class Polygon(object):
+    def __init__(self, inputs, spatial_reference=None):
+        self.inputs = inputs
+        self.spatialReference = spatial_reference or SpatialReference()
+
+    def projectAs(self, spatial_reference, transformation_name=None):
+        return Polygon(self.inputs, spatial_reference)
+
+
+class Field(object):
+    pass
+
+
+def FromWKB(wkb, spatial_reference=None):
+    return Polygon(wkb, spatial_reference)
+
+
+def Describe(value):
+    return types.SimpleNamespace(spatialReference=SpatialReference(describeFactoryCode), name=str(value))
+
+
+def ListTransformations(from_sr, to_sr, extent=None):
+    return []
+
+
+def AddFieldDelimiters(datasource, field):
+    return field
+
+
+def AddMessage(message):
+    pass
+
+
+def AddWarning(message):
+    pass
+
+
+class _Management(object):
+
+    def AddRastersToMosaicDataset(self, in_mosaic_dataset, raster_type, input_path, *args, **kwargs):
+        if addRastersHook:
+            rasters = input_path if isinstance(input_path, (list, tuple)) else str(input_path).split(';')
+            table = items.setdefault(in_mosaic_dataset, [])
+            for productName in addRastersHook(in_mosaic_dataset, raster_type, rasters) or []:
+                table.append({'OID@': len(table) + 1, 'ProductName': productName})
+        return in_mosaic_dataset
+
+    def __getattr__(self, name):
+        def tool(*args, **kwargs):
+            return args[0] if args else None
+        return tool
+
+management = _Management()
+
+
+class _Cursor(object):
+
+    def __init__(self, in_table, field_names, where_clause=None, *args, **kwargs):
+        self.table = in_table
+        self.fields = [field_names] if isinstance(field_names, str) else list(field_names)
+        self.where = where_clause or ''
+        self.descending = 'DESC' in str((kwargs.get('sql_clause') or (None, None))[1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        pass
+
+    def accepts(self, item):
+        match = re.search(r'OBJECTID > (\d+)', self.where)
+        if match and item['OID@'] <= int(match.group(1)):
+            return False
+        match = re.search(r'ProductName IN \((.*)\)', self.where)
+        if match and item['ProductName'] not in re.findall(r"'([^']*)'", match.group(1)):
+            return False
+        return True
+
+    def __iter__(self):
+        rows = [tuple(item.get(field) for field in self.fields) for item in items.get(self.table, []) if self.accepts(item)]
+        return iter(reversed(rows) if self.descending else rows)
+
+    def insertRow(self, row):
+        insertedRows[self.table] = insertedRows.get(self.table, 0) + 1
+
+    def updateRow(self, row):
+        pass
+
+    def deleteRow(self):
+        pass
+
+da = types.SimpleNamespace(InsertCursor=_Cursor, SearchCursor=_Cursor, UpdateCursor=_Cursor)
@@ -0,0 +1,164 @@
+#------------------------------------------------------------------------------
+# Copyright 2018 ArcGEO
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+
+# Benchmark of the hot paths of the raster type and SentinelImporter.py on synthetic tiles (see tilegen.py),
+# run against the arcpy stand-in in this folder. For every stage the number of items, the elapsed time,
+# items/s and the peak memory allocated by Python (tracemalloc, measured in a separate pass) are reported.
+#
+#   python benchmark/run.py --tiles 200 --mask-vertices 500 > bench_output.txt
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+benchmarkFolder = os.path.dirname(os.path.abspath(__file__))
+repositoryFolder = os.path.dirname(benchmarkFolder)
+# the arcpy stand-in must win over an installed arcpy
+sys.path.insert(0, benchmarkFolder)
+sys.path.insert(1, repositoryFolder)
+
+import arcpy
+import tilegen
+import SentinelImporter as importer
+
+
+def loadRasterType():
+    """ Sentinel-2-Tile.py is not importable by name, it is loaded from its file. """
+    spec = importlib.util.spec_from_file_location('Sentinel2Tile', os.path.join(repositoryFolder, 'Sentinel-2-Tile', 'Sentinel-2-Tile.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def clearCaches(*modules):
+    """ Clears the in-process caches, so every stage starts cold. """
+    for module in modules:
+        for value in list(vars(module).values()):
+            if hasattr(value, 'cache_clear'):
+                value.cache_clear()
+
+
+class Benchmark(object):
+
+    def __init__(self, rasterType, tiles, cloudMaskFC, batchSize=1, memory=True):
+        self.rasterType = rasterType
+        self.tiles = tiles
+        self.cloudMaskFC = cloudMaskFC
+        self.batchSize = batchSize
+        self.memory = memory
+        self.results = []
+        info = rasterType.RasterTypeFactory().getRasterTypesInfo()
+        self.builders = {t['rasterTypeName']: getattr(rasterType, t['builderName'])() for t in info}
+
+    def addRasters(self, mosaicDataset, rasterType, rasters):
+        builder = self.builders[rasterType]
+        productNames = []
+        for raster in rasters:
+            for item in builder.build({'path': raster}):
+                productNames.append(item['keyProperties'].get('ProductName'))
+        return productNames
+
+    def build(self, resolutions):
+        names = [importer.SentinelImporter.getRasterTypeName(r) for r in resolutions]
+        for tile in self.tiles:
+            for name in names:
+                self.builders[name].build({'path': tile})
+        return len(self.tiles) * len(names)
+
+    def parseMasks(self):
+        for tile in self.tiles:
+            importer.CloudMask.parseFeatures(importer.SentinelImporter.getCloudMaskPath(tile))
+        return len(self.tiles)
+
+    def importTiles(self, tilesFolder):
+        arcpy.addRastersHook = self.addRasters
+        arcpy.items.clear()
+        try:
+            processedTiles, failedTiles = importer.SentinelImporter.importTiles(tilesFolder, 'bench.gdb/S2-10m', '10m',
+                                                                                  self.cloudMaskFC, self.batchSize)
+        finally:
+            arcpy.addRastersHook = None
+        return len(processedTiles)
+
+    def measure(self, stage, function, *args):
+        """ Runs function cold, once timed and once with tracemalloc for the peak memory. """
+        clearCaches(self.rasterType, importer)
+        start = time.perf_counter()
+        items = function(*args)
+        seconds = time.perf_counter() - start
+        peak = None
+        if self.memory:
+            clearCaches(self.rasterType, importer)
+            tracemalloc.start()
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results.append((stage, items, seconds, peak))
+
+    def report(self, out=sys.stdout):
+        out.write("{0:<28}{1:>8}{2:>10}{3:>12}{4:>12}\n".format("stage", "items", "s", "items/s", "peak MiB"))
+        for stage, items, seconds, peak in self.results:
+            out.write("{0:<28}{1:>8}{2:>10.3f}{3:>12.1f}{4:>12}\n".format(stage, items, seconds, items / seconds if seconds else 0.0,
+                                                                      "{0:.1f}".format(peak / 1048576.0) if peak is not None else "-"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the Sentinel-2 raster type and importer on synthetic tiles.")
+    parser.add_argument('folder', nargs='?', help="tiles folder, synthetic tiles are generated to a temporary folder if omitted")
+    parser.add_argument('--tiles', type=int, default=100, help="number of synthetic tiles")
+    parser.add_argument('--mask-polygons', type=int, default=10, help="cloud mask polygons per tile")
+    parser.add_argument('--mask-vertices', type=int, default=100, help="vertices per cloud mask polygon")
+    parser.add_argument('--detectors', type=int, default=6, help="viewing angle grids per band in metadata.xml")
+    parser.add_argument('--batch-size', type=int, default=50, help="batchSize of importTiles")
+    parser.add_argument('--cache-file', help="persistent tile cache (SENTINEL2_TILE_CACHE), none by default")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc passes")
+    args = parser.parse_args()
+
+    if args.cache_file:
+        importer.TileCache.setCurrent(args.cache_file)
+    else:
+        os.environ.pop(importer.TILE_CACHE_VARIABLE, None)
+
+    tempFolder = None
+    tilesFolder = args.folder
+    start = time.perf_counter()
+    if not tilesFolder:
+        tempFolder = tempfile.mkdtemp(prefix='s2bench')
+        tilesFolder = tempFolder
+        tilegen.generateTiles(tilesFolder, args.tiles, args.mask_polygons, args.mask_vertices, args.detectors)
+        print("{0} tiles generated in {1:.1f}s.".format(args.tiles, time.perf_counter() - start))
+
+    try:
+        rasterType = loadRasterType()
+        tiles = importer.SentinelImporter.listTiles(tilesFolder)
+        benchmark = Benchmark(rasterType, tiles, 'bench.gdb/CloudMask', args.batch_size, not args.no_memory)
+        benchmark.measure('discovery', lambda: len(importer.SentinelImporter.listTiles(tilesFolder)))
+        for resolution in ('10m', '20m', '20c'):
+            benchmark.measure('build ' + resolution, benchmark.build, [resolution])
+        benchmark.measure('build 10m+20m+20c', benchmark.build, ['10m', '20m', '20c'])
+        benchmark.measure('mask parse', benchmark.parseMasks)
+        benchmark.measure('importTiles 10m + mask', benchmark.importTiles, tilesFolder)
+        benchmark.report()
+    finally:
+        if tempFolder:
+            shutil.rmtree(tempFolder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
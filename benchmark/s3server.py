@@ -0,0 +1,139 @@
+#------------------------------------------------------------------------------
+# Copyright 2018 ArcGEO
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+
+# Minimal local stand-in for an S3 compatible object store, to run S3Storage of SentinelImporter.py against
+# synthetic tiles (see tilegen.py). Every subfolder of the served folder is a bucket, requests are path style.
+# Only ListObjectsV2 (list-type=2 with prefix, max-keys and continuation-token) and GET of objects are supported,
+# signatures are not checked. A delay per request can be set to simulate the latency of a remote store.
+#
+#   python benchmark/s3server.py /tmp/s3 --port 9000 --delay 0.02
+
+import argparse
+import http.server
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+from xml.sax.saxutils import escape
+
+PAGE_SIZE = 1000
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class S3RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # set by serve
+    folder = None
+    delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        url = urllib.parse.urlsplit(self.path)
+        parts = urllib.parse.unquote(url.path).lstrip('/').split('/', 1)
+        bucketFolder = os.path.join(self.folder, parts[0])
+        if not parts[0] or not os.path.isdir(bucketFolder):
+            return self.sendError(404, 'NoSuchBucket')
+        if len(parts) == 1 or not parts[1]:
+            query = dict(urllib.parse.parse_qsl(url.query))
+            if query.get('list-type') != '2':
+                return self.sendError(501, 'NotImplemented')
+            return self.listObjects(parts[0], bucketFolder, query)
+        path = os.path.join(bucketFolder, *parts[1].split('/'))
+        if '..' in parts[1].split('/') or not os.path.isfile(path):
+            return self.sendError(404, 'NoSuchKey')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(1048576)
+                if not data:
+                    break
+                self.wfile.write(data)
+
+    def listObjects(self, bucket, bucketFolder, query):
+        prefix = query.get('prefix', '')
+        maxKeys = min(int(query.get('max-keys', PAGE_SIZE)), PAGE_SIZE)
+        start = query.get('continuation-token', '')
+        keys = []
+        for root, folders, files in os.walk(bucketFolder):
+            folders.sort()
+            relativeRoot = os.path.relpath(root, bucketFolder)
+            for name in files:
+                key = name if relativeRoot == '.' else '/'.join(relativeRoot.split(os.sep) + [name])
+                if key.startswith(prefix) and key > start:
+                    keys.append(key)
+        keys.sort()
+        page = keys[:maxKeys]
+        truncated = len(keys) > maxKeys
+        body = ['<?xml version="1.0" encoding="UTF-8"?>',
+                '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">',
+                '<Name>{0}</Name><Prefix>{1}</Prefix><KeyCount>{2}</KeyCount><MaxKeys>{3}</MaxKeys>'.format(
+                    escape(bucket), escape(prefix), len(page), maxKeys),
+                '<IsTruncated>{0}</IsTruncated>'.format('true' if truncated else 'false')]
+        if truncated:
+            body.append('<NextContinuationToken>{0}</NextContinuationToken>'.format(escape(page[-1])))
+        for key in page:
+            body.append('<Contents><Key>{0}</Key><Size>{1}</Size></Contents>'.format(
+                escape(key), os.path.getsize(os.path.join(bucketFolder, *key.split('/')))))
+        body.append('</ListBucketResult>')
+        self.sendXml(200, ''.join(body))
+
+    def sendError(self, status, code):
+        self.sendXml(status, '<?xml version="1.0" encoding="UTF-8"?><Error><Code>{0}</Code></Error>'.format(code))
+
+    def sendXml(self, status, body):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(folder, port=0, delay=0.0):
+    """ Starts the server on a background thread and returns it, server.server_address holds the port. """
+    handler = type('Handler', (S3RequestHandler,), {'folder': os.path.abspath(folder), 'delay': delay})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for an S3 compatible object store, subfolders are buckets.")
+    parser.add_argument('folder', help="folder to serve")
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before every response")
+    args = parser.parse_args()
+    server = serve(args.folder, args.port, args.delay)
+    print("Serving {0} at http://127.0.0.1:{1}".format(args.folder, server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
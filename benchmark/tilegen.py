@@ -0,0 +1,171 @@
+#------------------------------------------------------------------------------
+# Copyright 2018 ArcGEO
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+
+# Generates synthetic Sentinel-2 L2A tiles in the folder structure of the Amazon S3 archive
+# (tiles/<utmZone>/<latitudeBand>/<gridSquare>/<year>/<month>/<day>/<sequence>). Every tile has a metadata.xml
+# (PSD-12 or PSD-14 namespace) with full angle grids, tileInfo.json, empty band files in R10m, R20m and R60m
+# and qi/MSK_CLOUDS_B00.gml with a configurable number of polygons and vertices.
+#
+#   python tilegen.py <folder> [count] [maskPolygons] [maskVertices]
+
+import datetime
+import json
+import math
+import os
+import random
+import sys
+
+PSD = {12: 'https://psd-12.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd',
+       14: 'https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd'}
+
+bandFiles = {'R10m': ['B02', 'B03', 'B04', 'B08', 'AOT', 'TCI', 'WVP'],
+             'R20m': ['B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B11', 'B12', 'AOT', 'SCL', 'TCI', 'WVP'],
+             'R60m': ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B09', 'B11', 'B12', 'AOT', 'SCL', 'TCI', 'WVP'],
+             'qi': ['CLD_20m', 'CLD_60m', 'SNW_20m', 'SNW_60m']}
+
+# lower left corners of the 100x100km tiles are on a 109800m grid, the first one starts at x=199980
+TILE_SIZE = 109800
+GRID_ORIGIN = (199980, 0)
+GRID_COLUMNS = 'CDEFGHJK'
+GRID_ROWS = 'STUVWX'
+
+
+def getAngleGrid(random, base, spread, size=23):
+    return ''.join('<VALUES>{0}</VALUES>'.format(' '.join('{0:.5f}'.format(base + random.uniform(-spread, spread)) for c in range(size)))
+                   for r in range(size))
+
+def getAngles(random, detectors):
+    """ Tile_Angles with the sun and viewing incidence angle grids. The grids make up most of a real metadata.xml. """
+    angles = ['<Tile_Angles metadataLevel="Standard">']
+    grid = '<{0}><COL_STEP unit="m">5000</COL_STEP><ROW_STEP unit="m">5000</ROW_STEP><Values_List>{1}</Values_List></{0}>'
+    angles.append('<Sun_Angles_Grid>{0}{1}</Sun_Angles_Grid>'.format(grid.format('Zenith', getAngleGrid(random, 40.0, 1.0)),
+                                                                    grid.format('Azimuth', getAngleGrid(random, 160.0, 2.0))))
+    angles.append('<Mean_Sun_Angle><ZENITH_ANGLE unit="deg">40.1</ZENITH_ANGLE><AZIMUTH_ANGLE unit="deg">160.4</AZIMUTH_ANGLE></Mean_Sun_Angle>')
+    for band in range(13):
+        for detector in range(1, detectors + 1):
+            angles.append('<Viewing_Incidence_Angles_Grids bandId="{0}" detectorId="{1}">{2}{3}</Viewing_Incidence_Angles_Grids>'.format(
+                band, detector, grid.format('Zenith', getAngleGrid(random, 6.0, 3.0)), grid.format('Azimuth', getAngleGrid(random, 100.0, 20.0))))
+    angles.append('<Mean_Viewing_Incidence_Angle_List>')
+    for band in range(13):
+        angles.append('<Mean_Viewing_Incidence_Angle bandId="{0}"><ZENITH_ANGLE unit="deg">{1:.6f}</ZENITH_ANGLE>'
+                      '<AZIMUTH_ANGLE unit="deg">{2:.6f}</AZIMUTH_ANGLE></Mean_Viewing_Incidence_Angle>'.format(
+                          band, random.uniform(3.0, 9.0), random.uniform(80.0, 120.0)))
+    angles.append('</Mean_Viewing_Incidence_Angle_List></Tile_Angles>')
+    return ''.join(angles)
+
+def getMetadata(random, psd, epsg, ulx, uly, sensingTime, cloudCoverage, vegetationPercentage, detectors):
+    geocoding = ''.join('<Size resolution="{0}"><NROWS>{1}</NROWS><NCOLS>{1}</NCOLS></Size>'.format(r, TILE_SIZE // r) for r in (10, 20, 60))
+    geocoding += ''.join('<Geoposition resolution="{0}"><ULX>{1}</ULX><ULY>{2}</ULY><XDIM>{0}</XDIM><YDIM>-{0}</YDIM></Geoposition>'.format(r, ulx, uly)
+                         for r in (10, 20, 60))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<n1:Level-2A_Tile_ID xmlns:n1="{0}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<n1:General_Info><L1C_TILE_ID metadataLevel="Brief">S2A_OPER_MSI_L1C_TL_SGS__{1:%Y%m%dT%H%M%S}_N02.06</L1C_TILE_ID>'
+            '<SENSING_TIME metadataLevel="Standard">{1:%Y-%m-%dT%H:%M:%S}.024Z</SENSING_TIME>'
+            '<Archiving_Info metadataLevel="Expertise"><ARCHIVING_CENTRE>SGS_</ARCHIVING_CENTRE></Archiving_Info></n1:General_Info>'
+            '<n1:Geometric_Info><Tile_Geocoding metadataLevel="Brief"><HORIZONTAL_CS_NAME>WGS84 / UTM zone {2}N</HORIZONTAL_CS_NAME>'
+            '<HORIZONTAL_CS_CODE>EPSG:{3}</HORIZONTAL_CS_CODE>{4}</Tile_Geocoding>{5}</n1:Geometric_Info>'
+            '<n1:Quality_Indicators_Info metadataLevel="Standard">'
+            '<L1C_Image_Content_QI><CLOUD_COVERAGE_PERCENTAGE>{6:.6f}</CLOUD_COVERAGE_PERCENTAGE></L1C_Image_Content_QI>'
+            '<L2A_Image_Content_QI><NODATA_PIXEL_PERCENTAGE>0.0</NODATA_PIXEL_PERCENTAGE>'
+            '<CLOUD_COVERAGE_PERCENTAGE>{6:.6f}</CLOUD_COVERAGE_PERCENTAGE><VEGETATION_PERCENTAGE>{7:.6f}</VEGETATION_PERCENTAGE>'
+            '</L2A_Image_Content_QI></n1:Quality_Indicators_Info></n1:Level-2A_Tile_ID>').format(
+                PSD[psd], sensingTime, epsg - 32600, epsg, geocoding, getAngles(random, detectors), cloudCoverage, vegetationPercentage)
+
+def getMaskPolygon(random, ulx, uly, vertices):
+    """ Star shaped ring of vertices around a random center inside the tile. """
+    radius = random.uniform(500, 5000)
+    cx = random.uniform(ulx + radius, ulx + TILE_SIZE - radius)
+    cy = random.uniform(uly - TILE_SIZE + radius, uly - radius)
+    points = []
+    for i in range(vertices):
+        a = 2 * math.pi * i / vertices
+        r = radius * random.uniform(0.6, 1.0)
+        points.append('{0:.0f} {1:.0f}'.format(cx + r * math.cos(a), cy + r * math.sin(a)))
+    points.append(points[0])
+    return ' '.join(points)
+
+def getMask(random, epsg, ulx, uly, sensingTime, tileName, polygons, vertices):
+    features = []
+    for i in range(polygons):
+        maskType = 'OPAQUE' if i % 2 == 0 else 'CIRRUS'
+        features.append('<eop:MaskFeature gml:id="{0}.{1}"><eop:maskType codeSpace="urn:feature:type">{0}</eop:maskType>'
+                        '<eop:extentOf><gml:Polygon gml:id="{0}.{1}.G"><gml:exterior><gml:LinearRing>'
+                        '<gml:posList srsDimension="2">{2}</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></eop:extentOf>'
+                        '</eop:MaskFeature>'.format(maskType, i, getMaskPolygon(random, ulx, uly, vertices)))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<eop:Mask xmlns:eop="http://www.opengis.net/eop/2.0" xmlns:gml="http://www.opengis.net/gml/3.2" '
+            'gml:id="S2A_OPER_MSK_CLOUDS_SGS__{0:%Y%m%dT%H%M%S}_A000001_{1}_B00_MSIL2A">'
+            '<gml:boundedBy><gml:Envelope srsName="urn:ogc:def:crs:EPSG::{2}"><gml:lowerCorner>{3} {4}</gml:lowerCorner>'
+            '<gml:upperCorner>{5} {6}</gml:upperCorner></gml:Envelope></gml:boundedBy>'
+            '<eop:maskMembers>{7}</eop:maskMembers></eop:Mask>').format(
+                sensingTime, tileName, epsg, ulx, uly - TILE_SIZE, ulx + TILE_SIZE, uly, ''.join(features))
+
+def generateTile(folder, random, psd=14, utmZone=34, latitudeBand='U', gridSquare='DV', sensingTime=None, baseline='N0206',
+                 cloudCoverage=10.0, vegetationPercentage=40.0, maskPolygons=10, maskVertices=100, detectors=6):
+    """ Writes one tile to folder and returns the path of its metadata.xml. """
+    sensingTime = sensingTime or datetime.datetime(2018, 8, 20, 9, 50, 31)
+    epsg = 32600 + utmZone
+    ulx = GRID_ORIGIN[0] + GRID_COLUMNS.index(gridSquare[0]) * TILE_SIZE if gridSquare[0] in GRID_COLUMNS else GRID_ORIGIN[0]
+    uly = 5000020 + (GRID_ROWS.index(gridSquare[1]) + 1) * TILE_SIZE if gridSquare[1] in GRID_ROWS else 5000020
+    tileName = 'T{0}{1}{2}'.format(utmZone, latitudeBand, gridSquare)
+
+    for subfolder, bands in bandFiles.items():
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+        for band in bands:
+            open(os.path.join(folder, subfolder, band + '.jp2'), 'wb').close()
+
+    metadataPath = os.path.join(folder, 'metadata.xml')
+    with open(metadataPath, 'w') as f:
+        f.write(getMetadata(random, psd, epsg, ulx, uly, sensingTime, cloudCoverage, vegetationPercentage, detectors))
+
+    tileInfo = {'path': folder, 'timestamp': sensingTime.strftime('%Y-%m-%dT%H:%M:%S.024Z'),
+                'utmZone': utmZone, 'latitudeBand': latitudeBand, 'gridSquare': gridSquare,
+                'productName': 'S2A_MSIL2A_{0:%Y%m%dT%H%M%S}_{1}_R079_{2}_{0:%Y%m%dT%H%M%S}'.format(sensingTime, baseline, tileName),
+                'tileGeometry': {'type': 'Polygon', 'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:EPSG:8.8.1:{0}'.format(epsg)}},
+                                 'coordinates': [[[ulx, uly], [ulx + TILE_SIZE, uly], [ulx + TILE_SIZE, uly - TILE_SIZE],
+                                                  [ulx, uly - TILE_SIZE], [ulx, uly]]]},
+                'tileDataGeometry': {'type': 'Polygon', 'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:EPSG:8.8.1:{0}'.format(epsg)}},
+                                     'coordinates': [[[ulx, uly], [ulx + TILE_SIZE, uly], [ulx + TILE_SIZE, uly - TILE_SIZE],
+                                                      [ulx, uly - TILE_SIZE], [ulx, uly]]]},
+                'cloudyPixelPercentage': cloudCoverage}
+    with open(os.path.join(folder, 'tileInfo.json'), 'w') as f:
+        json.dump(tileInfo, f)
+
+    with open(os.path.join(folder, 'qi', 'MSK_CLOUDS_B00.gml'), 'w') as f:
+        f.write(getMask(random, epsg, ulx, uly, sensingTime, tileName, maskPolygons, maskVertices))
+    return metadataPath
+
+def generateTiles(folder, count, maskPolygons=10, maskVertices=100, detectors=6, seed=0):
+    """ Writes count tiles below folder, alternating PSD-12 and PSD-14 metadata, over 2 UTM zones, 4 grid squares
+    and consecutive days. Returns the paths of the metadata.xml files. """
+    rnd = random.Random(seed)
+    squares = [(34, 'U', 'DV'), (34, 'U', 'EV'), (35, 'U', 'CT'), (35, 'U', 'DT')]
+    tiles = []
+    for i in range(count):
+        utmZone, latitudeBand, gridSquare = squares[i % len(squares)]
+        sensingTime = datetime.datetime(2018, 1, 1, 9, 50, 31) + datetime.timedelta(days=i // len(squares))
+        tileFolder = os.path.join(folder, 'tiles', str(utmZone), latitudeBand, gridSquare,
+                                  str(sensingTime.year), str(sensingTime.month), str(sensingTime.day), '0')
+        tiles.append(generateTile(tileFolder, rnd, 12 if i % 2 else 14, utmZone, latitudeBand, gridSquare, sensingTime,
+                                  'N0206' if i % 3 else 'N0207', rnd.uniform(0, 100), rnd.uniform(0, 80),
+                                  maskPolygons, maskVertices, detectors))
+    return tiles
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    maskPolygons = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    maskVertices = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+    print("{0} tiles written.".format(len(generateTiles(sys.argv[1], count, maskPolygons, maskVertices))))